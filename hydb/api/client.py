@@ -68,18 +68,6 @@ class HyDbClient(BaseRPC):
     async def info_cache(self) -> schemas.ChainInfo:
         return await self.asyncc.info()
 
-    def sse_block_notify_create(self, block_pk: int) -> None:
-        self.get(
-            path=f"/sse/block/{block_pk}/{schemas.SSEBlockEvent.create}",
-            response_factory=lambda rsp: None
-        )
-
-    def sse_block_notify_mature(self, block_pk: int) -> None:
-        self.get(
-            path=f"/sse/block/{block_pk}/{schemas.SSEBlockEvent.mature}",
-            response_factory=lambda rsp: None
-        )
-
     def sse_block_next(self) -> schemas.BlockSSEResult:
         sse_client = self._sse_client(path="/sse/block/next")
 
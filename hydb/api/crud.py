@@ -1,8 +1,8 @@
 import sys
 from typing import Optional, List
 
-from deepdiff import DeepDiff
-from sqlalchemy import func, and_
+from ..util.jsoncmp import json_changed
+from sqlalchemy import and_
 
 from hydb.db import DB
 from hydb import db as models
@@ -96,7 +96,7 @@ def user_addr_update(db: DB, user_addr: models.UserAddr, addr_update: schemas.Us
             info = dict(user_addr.info)
             info.update(addr_update.info)
 
-            if DeepDiff(dict(user_addr.info), info):
+            if json_changed(dict(user_addr.info), info):
                 user_addr.info = info
                 updated = True
 
@@ -109,7 +109,7 @@ def user_addr_update(db: DB, user_addr: models.UserAddr, addr_update: schemas.Us
             data = dict(user_addr.data)
             data.update(addr_update.data)
 
-            if DeepDiff(dict(user_addr.data), data):
+            if json_changed(dict(user_addr.data), data):
                 user_addr.data = data
                 updated = True
 
@@ -151,43 +151,6 @@ def user_addr_token_del(db: DB, user_addr: models.UserAddr, address: str) -> sch
     )
 
 
-def block_get(db: DB, block_pk: int) -> Optional[schemas.Block]:
-    return db.session.query(
-        models.Block
-    ).where(
-        models.Block.pkid == block_pk
-    ).one_or_none()
-
-
-def sse_event_add(db: DB, event: str, data: schemas.BaseModel) -> models.Event:
-    ev = models.Event(
-        event=event,
-        data=data.json(encoder=str)
-    )
-
-    db.session.add(ev)
-    db.session.commit()
-    db.session.refresh(ev)
-    return ev
-
-
-def block_sse_result(db: DB, block: models.Block, event: schemas.SSEBlockEvent) -> schemas.BlockSSEResult:
-    return schemas.BlockSSEResult(
-        id=(db.session.query(func.max(models.Event.pkid)).scalar() or 0) + 1,  # Best guess, but monoticity is all we really need here.
-        event=event,
-        block=block,
-        hist=models.AddrHist.all_for_block(db, block)
-    )
-
-
-def block_sse_event_add(db: DB, block: models.Block, event: schemas.SSEBlockEvent) -> models.Event:
-    return sse_event_add(
-        db=db,
-        event="block",
-        data=block_sse_result(db, block, event)
-    )
-
-
 def stats_get(db: DB) -> Optional[schemas.Stats]:
     stats = models.Stat.current(db)
 
@@ -203,6 +166,6 @@ def stats_get(db: DB) -> Optional[schemas.Stats]:
 
 def info_get(db: DB) -> Optional[schemas.ChainInfo]:
     try:
-        return schemas.ChainInfo.get(db.rpc)
+        return schemas.ChainInfo.get(db.rpcc)
     except Exception as ex:
         print(ex, file=sys.stderr)
@@ -13,6 +13,8 @@ from pydantic import BaseModel, ConfigDict
 
 from hydra.rpc import HydraRPC
 
+from ..util import base58
+
 __all__ = (
     "timedelta_str",
     "UserMap",
@@ -48,6 +50,8 @@ __all__ = (
 
 _DecimalNew = Decimal | float | str | tuple[int, Sequence[int], int]
 
+_TOKEN_TRANSFER_ADDR_KEYS = "from", "fromHex", "to", "toHex", "addressHex"
+
 
 def timedelta_str(td: timedelta) -> str:
     td_msg = AttrDict()
@@ -192,69 +196,76 @@ class Block(Parent):
     conf: int
     info: AttrDict | dict
     tx: list[AttrDict | dict]
+    tx_addr: dict[str, list[int]] | None = None
 
     def filter_tx(self, address: str):
-        return filter(lambda tx: address in list(Block.tx_yield_addrs(tx)), self.tx)
+        if self.tx_addr is not None:
+            return map(self.tx.__getitem__, self.tx_addr.get(address, ()))
+
+        return filter(lambda tx: address in Block.tx_addrs(tx), self.tx)
+
+    def filter_tx_any(self, *addresses: str):
+        """Transactions involving any of the addresses, in block order.
+        """
+        if self.tx_addr is not None:
+            return map(self.tx.__getitem__, sorted({i for a in addresses for i in self.tx_addr.get(a, ())}))
+
+        return filter(lambda tx: not Block.tx_addrs(tx).isdisjoint(addresses), self.tx)
+
+    @staticmethod
+    def tx_addr_index(txes: list) -> dict[str, list[int]]:
+        """Map each address in txes to the indices of the transactions referencing it.
+        """
+        index = {}
+
+        for i, tx in enumerate(txes):
+            for address in Block.tx_addrs(tx):
+                index.setdefault(address, []).append(i)
+
+        return index
 
     @staticmethod
-    def tx_yield_addrs(tx: dict):
+    def tx_addrs(tx: dict) -> set[str]:
+        """Addresses referenced by a transaction, in one pass without building intermediate lists.
+        """
         # Address locations:
         # .[inputs|outputs].address[Hex]
         #                  .receipt.[sender|contractAddressHex]
         #                          .logs.addressHex    <-- Other contracts involved will have a separate TX (I think?).
         # .contractSpends.[inputs|outputs].addressHex  <-- Duplicated in separate TX! Indicated by contractSpendSource from the second TX.
         # .qrc[20|721]TokenTransfers.[to|toHex|from|fromHex|addressHex]
+        addrs = set()
+        add = addrs.add
 
-        for vio in (tx.get("inputs", []) + tx.get("outputs", [])):
-            if "addressHex" in vio:
-                yield vio["addressHex"]
-            elif "address" in vio:
-                yield vio["address"]
-
-            receipt = vio.get("receipt", None)
+        for vios in (tx.get("inputs", ()), tx.get("outputs", ())):
+            for vio in vios:
+                if "addressHex" in vio:
+                    add(vio["addressHex"])
+                elif "address" in vio:
+                    add(vio["address"])
 
-            if receipt is not None:
+                receipt = vio.get("receipt", None)
 
-                a = receipt.get("sender", None)
+                if receipt is not None:
+                    a = receipt.get("sender", None)
 
-                if a is not None:
-                    yield a
+                    if a is not None:
+                        add(a)
 
-                a = receipt.get("contractAddressHex", None)
+                    a = receipt.get("contractAddressHex", None)
 
-                if a is not None:
-                    yield a
+                    if a is not None:
+                        add(a)
 
-                # for logi in receipt.get("logs", []):
-                #     if "addressHex" in logi:
-                #         yield logi["addressHex"]
+        for token_transfers in (tx.get("qrc20TokenTransfers", ()), tx.get("qrc721TokenTransfers", ())):
+            for token_transfer in token_transfers:
+                for key in _TOKEN_TRANSFER_ADDR_KEYS:
+                    a = token_transfer.get(key, None)
 
-        # contract_spends = tx.get("contractSpends", {})
-        #
-        # for contract_spend in contract_spends:
-        #     for cs_io in contract_spend.get("inputs", []) + contract_spend.get("outputs", []):
-        #         a = cs_io.get("addressHex", cs_io.get("address", ...))
-        #         if a is not ...:
-        #             yield a
+                    if a is not None:
+                        add(a)
 
-        token_transfers = tx.get("qrc20TokenTransfers", []) + tx.get("qrc721TokenTransfers", [])
-
-        for token_transfer in token_transfers:
-            a = token_transfer.get("from", None)
-            if a is not None:
-                yield a
-            a = token_transfer.get("fromHex", None)
-            if a is not None:
-                yield a
-            a = token_transfer.get("to", None)
-            if a is not None:
-                yield a
-            a = token_transfer.get("toHex", None)
-            if a is not None:
-                yield a
-            a = token_transfer.get("addressHex", None)
-            if a is not None:
-                yield a
+        return addrs
 
 
 class AddrHistBase(Parent):
@@ -287,8 +298,7 @@ class AddrBase(Parent):
         return self.addr_hy if self.addr_tp.value == Addr.Type.H else self.addr_hx
 
     def filter_tx(self, block: Block):
-        addr_match = lambda addrs: self.addr_hx in addrs or self.addr_hy in addrs
-        return filter(lambda tx: addr_match(list(Block.tx_yield_addrs(tx))), block.tx)
+        return block.filter_tx_any(self.addr_hx, self.addr_hy)
 
     @staticmethod
     def soft_validate(address: str, testnet: bool | None = None) -> AddrBase.Type | None:
@@ -312,8 +322,16 @@ class AddrBase(Parent):
             return None
 
         if base == 36:
-            if (testnet is True and address[0].lower() != 't' or
-               testnet is False and address[0].lower() != 'h'):
+            try:
+                version, payload = base58.b58check_decode(address)
+            except ValueError:
+                return None
+
+            if len(payload) != 20:
+                return None
+
+            if (testnet is True and version != base58.P2PKH_TESTNET or
+               testnet is False and version != base58.P2PKH_MAINNET):
                 return None
 
         return (
@@ -337,7 +355,7 @@ Addr.model_rebuild(force=True)  # TODO: Determine whether this is still necessar
 class UserUniq(Parent):
     pkid: int
     date_create: datetime
-    date_update: datetime | None
+    date_update: datetime | None = None  # Not a column of user_uniq.
     time_create: int
     name_weight: int
     name: str
@@ -60,22 +60,6 @@ def info_get(db: DB = Depends(dbase.sessioned)):
     return info
 
 
-@app.get("/sse/block/{block_pk}/{block_ev}")
-def db_notify_block(block_pk: int, block_ev: schemas.SSEBlockEvent, db: DB = Depends(dbase.sessioned)):
-    block: models.Block = crud.block_get(db=db, block_pk=block_pk)
-
-    if block is None:
-        raise HTTPException(status_code=404, detail=f"Block #{block_pk} not found.")
-
-    if block_ev not in (schemas.SSEBlockEvent.create, schemas.SSEBlockEvent.mature):
-        # Should not be allowed to happen per schema.
-        raise HTTPException(status_code=500, detail=f"Unknown block event '{block_ev}'.")
-
-    ev: models.Event = crud.block_sse_event_add(db=db, block=block, event=block_ev)
-
-    log.debug(f"Event #{ev.pkid} added for block #{block.height}")
-
-
 @app.router.get('/sse/block')
 async def sse_block(request: Request, db: DB = Depends(dbase.sessioned)):
     event_generator = EventManager.block_event_generator(
@@ -1,12 +1,12 @@
 from __future__ import annotations
 import enum
-from functools import lru_cache
-from typing import Optional, Tuple
+import time
+from typing import Optional, Tuple, Set, List, Iterable
 import binascii
+import json
 from attrdict import AttrDict
-from deepdiff import DeepDiff
 
-from sqlalchemy import Column, String, Enum, Integer
+from sqlalchemy import Column, String, Enum, Integer, func, event as sa_event
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm import relationship
 
@@ -17,11 +17,70 @@ from hydra.rpc import BaseRPC
 from .base import *
 from .db import DB
 from .block import Block
-from .addr_hist import AddrHist
+from .addr_hist import AddrHist, AddrHistBatch
+from ..util import base58
+from ..util.cache import LruTtlCache
+from ..util.jsoncmp import json_changed
 
 __all__ = "Addr", "AddrHist"
 
 
+class AddrWatch:
+    """In-process index of watched addresses, used to discard blocks without a DB query.
+
+    Inserts and deletes in this process are tracked through mapper events, while
+    changes from other processes (e.g. the API) are picked up by refresh().
+    """
+    REFRESH_SECONDS = 10
+
+    hy: Set[str]
+    hx: Set[str]
+    version: Optional[tuple]
+    refreshed: float
+
+    def __init__(self):
+        self.hy = set()
+        self.hx = set()
+        self.version = None
+        self.refreshed = 0
+
+    def refresh(self, db: DB, max_age: Optional[float] = None) -> None:
+        """Reload when the (count, max pkid) version of the addr table has changed.
+
+        Since pkids only increase, any net change to the set of rows changes the version.
+        """
+        now = time.monotonic()
+
+        if max_age is not None and self.version is not None and now - self.refreshed < max_age:
+            return
+
+        version = tuple(db.session.query(func.count(Addr.pkid), func.max(Addr.pkid)).one())
+        self.refreshed = now
+
+        if version == self.version:
+            return
+
+        rows = db.session.query(Addr.addr_hy, Addr.addr_hx).all()
+
+        self.hy = {row.addr_hy for row in rows}
+        self.hx = {row.addr_hx for row in rows}
+        self.version = version
+
+        log.debug(f"Loaded {len(rows)} watched addresses.")
+
+    def add(self, addr: Addr) -> None:
+        self.hy.add(addr.addr_hy)
+        self.hx.add(addr.addr_hx)
+
+    def discard(self, addr: Addr) -> None:
+        self.hy.discard(addr.addr_hy)
+        self.hx.discard(addr.addr_hx)
+        self.version = None  # The delete may still be rolled back, so re-check on next refresh.
+
+    def filter(self, addresses_hy: Set[str], addresses_hx: Set[str]) -> Tuple[Set[str], Set[str]]:
+        return addresses_hy & self.hy, addresses_hx & self.hx
+
+
 class Addr(Base):
     __tablename__ = "addr"
     __table_args__ = (
@@ -79,31 +138,32 @@ class Addr(Base):
         single_parent=True,
     )
 
+    watch = AddrWatch()
+
     def __str__(self):
         return self.addr_hy if self.addr_tp == Addr.Type.H else self.addr_hx
 
     def __hash__(self):
         return hash(str(self))
 
-    def on_block_create(self, db: DB, block: Block) -> bool:
+    def on_block_create(self, db: DB, batch: AddrHistBatch, fetched: Optional[Tuple[int, Optional[dict]]]) -> bool:
+        """Record history for a new block, given the result of fetch_info() for it.
+        """
         if not len(self.addr_users):  # Should not happen for now, but...
             return False
 
         info_old = dict(self.info)
 
-        self.update_info(db)
+        self.apply_info(db, fetched)
 
-        addr_hist: AddrHist = AddrHist(
-            block=block,
+        hist = batch.add(
             addr=self,
             info_old=info_old,
             info_new=self.info
         )
 
-        db.session.add(addr_hist)
-
         for addr_user in self.addr_users:
-            addr_user.on_new_addr_hist(db, addr_hist)
+            addr_user.on_new_addr_hist(db, batch, hist)
 
         return True
 
@@ -113,18 +173,19 @@ class Addr(Base):
 
         return False
 
-    def on_fork(self, db: DB, addr_hist: AddrHist):
-        self.block_h = addr_hist.block.height
-        self.info = addr_hist.info_old
-        db.session.add(self)
-
     def update_info(self, db: DB) -> bool:
-        block_height: int = db.rpc.getblockcount()
+        return self.apply_info(db, self.fetch_info(db))
 
-        if self.info and block_height <= self.block_h:
-            return False
+    def fetch_info(self, db: DB) -> Optional[Tuple[int, Optional[dict]]]:
+        """Network half of update_info(): fetch new info without touching the session or this object.
 
-        self.block_h = block_height
+        Returns None when the info is already current, otherwise (block_height, info or None on error).
+        Safe to run on a worker thread as long as this object's attributes are loaded.
+        """
+        block_height: int = db.rpcc.getblockcount()
+
+        if self.info and block_height <= self.block_h:
+            return None
 
         try:
             if self.addr_tp == Addr.Type.H:
@@ -141,51 +202,158 @@ class Addr(Base):
 
         except BaseRPC.Exception as exc:
             log.critical(f"Addr RPC error: {str(exc)}", exc_info=exc)
-            return False
+            return block_height, None
 
         for qrc721entry in info.get("qrc721Balances", []):
             qrc721entry["uris"] = self.nft_uris_from(db, qrc721entry["addressHex"], qrc721entry["count"])
 
-        if self.info is None or DeepDiff(dict(self.info), dict(info)):
+        return block_height, info
+
+    def apply_info(self, db: DB, fetched: Optional[Tuple[int, Optional[dict]]]) -> bool:
+        """Session half of update_info(): apply the result of fetch_info().
+        """
+        if fetched is None:
+            return False
+
+        block_height, info = fetched
+
+        self.block_h = block_height
+
+        if info is None:
+            return False
+
+        if self.info is None or json_changed(dict(self.info), dict(info)):
             self.info = info
             db.session.add(self)
             return True
 
         return False
 
-    @lru_cache(maxsize=None)
+    def info_from_txes(self, txes: List[dict]) -> dict:
+        """Reconstruct info after txes from the current info, without an explorer call.
+
+        Balances and totals are moved by the HYDRA and QRC20 deltas in txes; fields that
+        transactions don't determine (e.g. staking, NFT URIs) are carried over as-is.
+        """
+        addresses = {self.addr_hy, self.addr_hx}
+        info = json.loads(json.dumps(self.info or {}))
+
+        received = sent = count = 0
+        tokens = {}
+
+        for tx in txes:
+            involved = False
+
+            for vin in tx.get("inputs", ()):
+                if vin.get("address") in addresses or vin.get("addressHex") in addresses:
+                    sent += int(vin.get("value", 0))
+                    involved = True
+
+            for vout in tx.get("outputs", ()):
+                if vout.get("address") in addresses or vout.get("addressHex") in addresses:
+                    received += int(vout.get("value", 0))
+                    involved = True
+
+            for transfer in tx.get("qrc20TokenTransfers", ()):
+                token = transfer.get("addressHex")
+                value = int(transfer.get("value", 0))
+
+                if transfer.get("to") in addresses or transfer.get("toHex") in addresses:
+                    tokens[token] = tokens.get(token, 0) + value
+                    involved = True
+
+                if transfer.get("from") in addresses or transfer.get("fromHex") in addresses:
+                    tokens[token] = tokens.get(token, 0) - value
+                    involved = True
+
+            count += involved
+
+        if received or sent:
+            info["balance"] = str(int(info.get("balance", 0)) + received - sent)
+            info["totalReceived"] = str(int(info.get("totalReceived", 0)) + received)
+            info["totalSent"] = str(int(info.get("totalSent", 0)) + sent)
+
+        if count and "transactionCount" in info:
+            info["transactionCount"] += count
+
+        for entry in info.get("qrc20Balances", ()):
+            delta = tokens.get(entry.get("addressHex"))
+
+            if delta:
+                entry["balance"] = str(int(entry.get("balance", 0)) + delta)
+
+        return info
+
+    @staticmethod
+    def refresh_all(db: DB, pkids: Iterable[int]) -> None:
+        """Fetch and apply explorer info once for each of pkids, e.g. after a catch-up.
+        """
+        addrs: List[Addr] = db.session.query(
+            Addr
+        ).where(
+            Addr.pkid.in_(list(pkids))
+        ).populate_existing().all()
+
+        if not len(addrs):
+            return
+
+        fetched = list(db.addr_pool.map(lambda addr: addr.fetch_info(db), addrs))
+
+        for addr, addr_fetched in zip(addrs, fetched):
+            addr.apply_info(db, addr_fetched)
+
+        db.session.commit()
+        log.info(f"Refreshed info for {len(addrs)} address(es) after catch-up.")
+
     def nft_uris_from(self, db: DB, nft_addr_hx: str, count: int) -> dict:
-        uris = {}
-
-        for token_no in range(count):
-            r = db.rpc.callcontract(
-                nft_addr_hx,
-                Addr.ContractMethodID.tokenOfOwnerByIndex
-                + self.addr_hx.zfill(64)
-                + hex(token_no)[2:].zfill(64)
-            )
+        """Map token ID -> URI for the count tokens of contract nft_addr_hx owned by this address.
 
-            if r.executionResult.excepted != "None":
-                log.warning(f"Contract call tokenOfOwnerByIndex failed: {r.executionResult.excepted}")
-                log.debug(f"Contract call failed (full result): {r}")
-            else:
-                token_id: str = hex(int(r.executionResult.output, 16))[2:]
+        Results are kept in db.nft_cache per (contract, owner, count) until they expire,
+        and the per-token contract calls are issued concurrently on db.rpc_pool.
+        """
+        key = nft_addr_hx, self.addr_hx, count
+        uris = db.nft_cache.get(key, None)
 
-                r = db.rpc.callcontract(
-                    nft_addr_hx,
-                    Addr.ContractMethodID.tokenURI
-                    + r.executionResult.output
-                )
+        if uris is None:
+            owner_hx = self.addr_hx
 
-                if r.executionResult.excepted != "None":
-                    log.warning(f"Contract call tokenURI failed: {r.executionResult.excepted}")
-                    log.debug(f"Contract call failed (full result): {r}")
-                else:
-                    token_uri = Addr.__sc_out_str(r.executionResult.output)
+            uris = dict(filter(None, db.rpc_pool.map(
+                lambda token_no: Addr.__nft_uri_at(db, nft_addr_hx, owner_hx, token_no),
+                range(count)
+            )))
+
+            db.nft_cache.put(key, uris)
+
+        return dict(uris)
+
+    @staticmethod
+    def __nft_uri_at(db: DB, nft_addr_hx: str, owner_hx: str, token_no: int) -> Optional[Tuple[str, str]]:
+        r = db.rpc.callcontract(
+            nft_addr_hx,
+            Addr.ContractMethodID.tokenOfOwnerByIndex
+            + owner_hx.zfill(64)
+            + hex(token_no)[2:].zfill(64)
+        )
+
+        if r.executionResult.excepted != "None":
+            log.warning(f"Contract call tokenOfOwnerByIndex failed: {r.executionResult.excepted}")
+            log.debug(f"Contract call failed (full result): {r}")
+            return None
 
-                    uris[token_id] = token_uri
+        token_id: str = hex(int(r.executionResult.output, 16))[2:]
+
+        r = db.rpc.callcontract(
+            nft_addr_hx,
+            Addr.ContractMethodID.tokenURI
+            + r.executionResult.output
+        )
+
+        if r.executionResult.excepted != "None":
+            log.warning(f"Contract call tokenURI failed: {r.executionResult.excepted}")
+            log.debug(f"Contract call failed (full result): {r}")
+            return None
 
-        return uris
+        return token_id, Addr.__sc_out_str(r.executionResult.output)
 
     # noinspection PyUnusedLocal
     def __ensure_imported(self, db: DB):
@@ -231,46 +399,94 @@ class Addr(Base):
             return addr
 
     @staticmethod
-    @lru_cache(maxsize=None)
+    def cached(db: DB, key: tuple, fn, negative=lambda result: False):
+        """Return fn() through db.addr_cache, keeping negative results (and ValueError) for addr_cache_neg_ttl only.
+        """
+        result = db.addr_cache.get(key)
+
+        if result is LruTtlCache.MISSING:
+            try:
+                result = fn()
+            except ValueError as exc:
+                db.addr_cache.put(key, exc, ttl=db.addr_cache_neg_ttl)
+                raise
+
+            db.addr_cache.put(key, result, ttl=db.addr_cache_neg_ttl if negative(result) else None)
+
+        if isinstance(result, ValueError):
+            raise ValueError(*result.args)
+
+        return result
+
+    @staticmethod
     def validate(db: DB, address: str):
-        av = db.rpc.validateaddress(address)
-        return av
+        return Addr.cached(db, ("validateaddress", address), lambda: db.rpc.validateaddress(address), lambda av: not av.isvalid)
 
     @staticmethod
-    @lru_cache(maxsize=None)
     def gethexaddress(db: DB, address: str):
-        addr_hx = db.rpc.gethexaddress(address)
-        return addr_hx
+        return Addr.cached(db, ("gethexaddress", address), lambda: db.rpc.gethexaddress(address))
 
     @staticmethod
-    @lru_cache(maxsize=None)
     def fromhexaddress(db: DB, address: str):
-        addr_hy = db.rpc.fromhexaddress(address)
-        return addr_hy
+        return Addr.cached(db, ("fromhexaddress", address), lambda: db.rpc.fromhexaddress(address))
 
     # noinspection PyUnusedLocal
     @staticmethod
-    @lru_cache(maxsize=None)  # passing block_height can force a non-cached response with updated info.
     def normalize(db: DB, address: str, block_height: Optional[int] = None) -> Tuple[Addr.Type, str, str, AttrDict]:
-        """Normalize an input address into a tuple of (Addr.Type, addr_hex, addr_hydra).
+        """Normalize an input address into a tuple of (Addr.Type, addr_hex, addr_hydra, contract_info).
         Or raise ValueError.
         """
-        addr_tp = Addr.Type.by_len(address)
+        addr_tp, addr_hx, addr_hy = Addr.resolve(db, address)
         sci = AttrDict()
 
+        if addr_tp == Addr.Type.S:
+            try:
+                addr_tp, sci = Addr.validate_contract(db, addr_hx)
+            except BaseRPC.Exception as exc:
+                log.critical(f"Addr normalize RPC error: {str(exc)}", exc_info=exc)
+                raise
+
+        return addr_tp, addr_hx, addr_hy, sci
+
+    @staticmethod
+    def resolve(db: DB, address: str) -> Tuple[Addr.Type, str, str]:
+        """Convert an input address into (Addr.Type.H or Addr.Type.S by length, addr_hex, addr_hydra).
+        Or raise ValueError.
+        """
+        return Addr.cached(db, ("resolve", address), lambda: Addr.__resolve(db, address))
+
+    @staticmethod
+    def __resolve(db: DB, address: str) -> Tuple[Addr.Type, str, str]:
+        addr_tp = Addr.Type.by_len(address)
+
         if addr_tp is None:
             raise ValueError(f"Invalid HYDRA or smart contract address '{address}' (bad length)")
 
         try:
             if addr_tp == Addr.Type.H:
 
-                valid = Addr.validate(db, address)
-
-                if not valid.isvalid:
+                try:
+                    version, _ = base58.b58check_decode(address)
+                except ValueError:
                     raise ValueError(f"Invalid HYDRA or smart contract address '{address}' (validation failed)")
 
-                addr_hy = valid.address
-                addr_hx = Addr.gethexaddress(db, addr_hy)
+                if version == base58.p2pkh_version(db.rpc.mainnet):
+                    addr_hy = address
+                    addr_hx = base58.address_to_hex(address, mainnet=db.rpc.mainnet)
+                else:
+                    # Other address versions are left to the node, unless already stored.
+                    addr_hx = db.session.query(Addr.addr_hx).where(Addr.addr_hy == address).scalar()
+
+                    if addr_hx is not None:
+                        return addr_tp, addr_hx, address
+
+                    valid = Addr.validate(db, address)
+
+                    if not valid.isvalid:
+                        raise ValueError(f"Invalid HYDRA or smart contract address '{address}' (validation failed)")
+
+                    addr_hy = valid.address
+                    addr_hx = Addr.gethexaddress(db, addr_hy)
 
             elif addr_tp == Addr.Type.S:
 
@@ -279,9 +495,7 @@ class Addr(Base):
                 except ValueError:
                     raise ValueError(f"Invalid HYDRA or smart contract address '{address}' (conversion failed)")
 
-                addr_hy = Addr.fromhexaddress(db, addr_hx)
-
-                addr_tp, sci = Addr.validate_contract(db, addr_hx)
+                addr_hy = base58.hex_to_address(addr_hx, mainnet=db.rpc.mainnet)
 
             else:
                 raise ValueError(f"Invalid HYDRA or smart contract address '{address}' (bad type)")
@@ -290,12 +504,38 @@ class Addr(Base):
             log.critical(f"Addr normalize RPC error: {str(exc)}", exc_info=exc)
             raise
 
-        return addr_tp, addr_hx, addr_hy, sci
+        return addr_tp, addr_hx, addr_hy
 
     @staticmethod
-    # @lru_cache(maxsize=None)  # Not caching here because the total supply can change.
     def validate_contract(db: DB, addr_hx: str) -> Tuple[Addr.Type, AttrDict]:
+        """Determine the contract type and metadata of addr_hx, backed by the contract table.
 
+        Returns Addr.Type.H when addr_hx is not a contract.
+        """
+        from .contract import Contract
+
+        contract = Contract.get(db, addr_hx)
+
+        if contract is None:
+            # Already known as a HYDRA address from an earlier probe.
+            if db.session.query(Addr.addr_tp).where(Addr.addr_hx == addr_hx).scalar() == Addr.Type.H:
+                return Addr.Type.H, AttrDict()
+
+            addr_tp, sci = Addr.cached(
+                db, ("contract", addr_hx),
+                lambda: Addr.__probe_contract(db, addr_hx),
+                lambda result: result[0] == Addr.Type.H
+            )
+
+            if addr_tp == Addr.Type.H:
+                return addr_tp, AttrDict(sci)
+
+            contract = Contract.add(db, addr_hx, addr_tp, sci)
+
+        return contract.addr_tp, contract.sci()
+
+    @staticmethod
+    def __probe_contract(db: DB, addr_hx: str) -> Tuple[Addr.Type, AttrDict]:
         addr_tp = Addr.Type.S
         sci = AttrDict()
 
@@ -339,3 +579,13 @@ class Addr(Base):
     @staticmethod
     def __sc_out_str(val):
         return binascii.unhexlify(val).replace(b"\x00", b"").decode("utf-8", errors="ignore")
+
+
+@sa_event.listens_for(Addr, "after_insert")
+def _addr_after_insert(mapper, connection, target: Addr):
+    Addr.watch.add(target)
+
+
+@sa_event.listens_for(Addr, "after_delete")
+def _addr_after_delete(mapper, connection, target: Addr):
+    Addr.watch.discard(target)
@@ -1,16 +1,18 @@
 from __future__ import annotations
 
-from typing import List
+from datetime import datetime
+from typing import List, Tuple
 
 from hydra import log
-from sqlalchemy import Column, ForeignKey, Integer, Boolean
+from sqlalchemy import Column, ForeignKey, Integer, Boolean, insert
 from sqlalchemy.orm import relationship
 
 from .base import *
 from .db import DB
 from .block import Block
+from ..api import schemas
 
-__all__ = "AddrHist",
+__all__ = "AddrHist", "AddrHistBatch"
 
 
 class AddrHist(Base):
@@ -47,14 +49,6 @@ class AddrHist(Base):
         self.info_new = self.addr.info
 
         db.session.add(self)
-        db.session.commit()
-
-    def on_fork(self, db: DB):
-
-        self.addr.on_fork(db, self)
-
-        for user_hist in self.addr_hist_user:
-            user_hist.on_fork(db)
 
     def _removed_user(self, db: DB):
         if not len(self.addr_hist_user):
@@ -75,3 +69,105 @@ class AddrHist(Base):
         ).all()
 
         return ahs
+
+
+class AddrHistBatch:
+    """AddrHist and UserAddrHist rows for one new block, written with multi-row inserts.
+
+    Primary keys come from their sequences in one query per table, so user rows can
+    reference their AddrHist row without a flush per object.
+    """
+    block: Block
+    addr_hist: List[Tuple[object, dict]]  # (Addr, row)
+    user_addr_hist: List[Tuple[object, int, dict]]  # (UserAddr, addr_hist index, row)
+    hist_pkids: List[int]
+    user_pkids: List[int]
+
+    def __init__(self, block: Block):
+        self.block = block
+        self.addr_hist = []
+        self.user_addr_hist = []
+        self.hist_pkids = []
+        self.user_pkids = []
+
+    def __len__(self):
+        return len(self.addr_hist)
+
+    def add(self, addr, info_old: dict, info_new: dict) -> int:
+        self.addr_hist.append((addr, dict(addr_pk=addr.pkid, info_old=info_old, info_new=info_new)))
+        return len(self.addr_hist) - 1
+
+    def add_user(self, hist: int, user_addr) -> None:
+        self.user_addr_hist.append((user_addr, hist, dict(
+            user_addr_pk=user_addr.pkid,
+            date_create=datetime.utcnow(),  # Explicit so that hist_results() matches the stored row.
+            block_t=user_addr.block_t,
+            block_c=user_addr.block_c,
+        )))
+
+    def mined(self, hist: int) -> bool:
+        return self.block.info.get("miner", "") == self.addr_hist[hist][0].addr_hy
+
+    def insert(self, db: DB) -> None:
+        """Insert all rows; the block must already be flushed so that its pkid is known.
+        """
+        from .user_addr_hist import UserAddrHist
+
+        if not len(self.addr_hist):
+            return
+
+        self.hist_pkids = hist_pkids = DbSequenceNext(db.session, AddrHist.__table__.c.pkid.default.name, len(self.addr_hist))
+
+        db.session.execute(
+            insert(AddrHist.__table__),
+            [
+                dict(row, pkid=pkid, block_pk=self.block.pkid)
+                for pkid, (_, row) in zip(hist_pkids, self.addr_hist)
+            ]
+        )
+
+        if len(self.user_addr_hist):
+            self.user_pkids = user_pkids = DbSequenceNext(db.session, UserAddrHist.__table__.c.pkid.default.name, len(self.user_addr_hist))
+
+            db.session.execute(
+                insert(UserAddrHist.__table__),
+                [
+                    dict(row, pkid=pkid, addr_hist_pk=hist_pkids[hist])
+                    for pkid, (_, hist, row) in zip(user_pkids, self.user_addr_hist)
+                ]
+            )
+
+        # Collections loaded before the insert don't know about the new rows.
+        db.session.expire(self.block, ["addr_hist"])
+
+        for addr, _ in self.addr_hist:
+            db.session.expire(addr, ["addr_hist"])
+
+        for user_addr, _, _ in self.user_addr_hist:
+            db.session.expire(user_addr, ["user_addr_hist"])
+
+    def hist_results(self) -> List[schemas.AddrHistResult]:
+        """The inserted rows as event payload, built from what is held here instead of reading them back.
+        """
+        users = [[] for _ in self.addr_hist]
+
+        for pkid, (user_addr, hist, row) in zip(self.user_pkids, self.user_addr_hist):
+            users[hist].append(schemas.UserAddrHistResult(
+                pkid=pkid,
+                addr_hist_pk=self.hist_pkids[hist],
+                data=None,
+                user_addr=user_addr,
+                **row
+            ))
+
+        return [
+            schemas.AddrHistResult(
+                pkid=pkid,
+                block_pk=self.block.pkid,
+                mined=self.mined(hist),
+                addr=addr,
+                addr_hist_user=users[hist],
+                **row
+            )
+            for hist, (pkid, (addr, row)) in enumerate(zip(self.hist_pkids, self.addr_hist))
+        ]
@@ -1,5 +1,7 @@
+from typing import List
+
 from attrdict import AttrDict
-from sqlalchemy import Column, DateTime, func, Integer, Sequence, Index, MetaData
+from sqlalchemy import Column, DateTime, func, Integer, Sequence, Index, MetaData, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from sqlalchemy_json import mutable_json_type
@@ -9,6 +11,7 @@ __all__ = (
     "DbPkidColumn", "DbDateCreateColumn", "DbDateUpdateColumn",
     "DbInfoColumn", "DbDataColumn",
     "DbInfoColumnIndex",
+    "DbSequenceNext",
 )
 
 
@@ -33,6 +36,18 @@ def DbInfoColumnIndex(table_name: str, column_name: str = "info"):
     )
 
 
+def DbSequenceNext(session, seq: str, count: int) -> List[int]:
+    """Allocate count values from a sequence in a single round trip, for bulk inserts.
+    """
+    if count <= 0:
+        return []
+
+    return list(session.execute(
+        text("SELECT nextval(:seq) FROM generate_series(1, :count)"),
+        {"seq": seq, "count": count}
+    ).scalars())
+
+
 DbPkidColumn = lambda seq="pkid_seq": Column(
     Integer, Sequence(seq, metadata=Base.metadata), nullable=False, primary_key=True, unique=True
 )
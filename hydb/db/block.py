@@ -1,18 +1,23 @@
 from __future__ import annotations
 
+import heapq
 import time
-from typing import Optional, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Optional, List, Tuple, Dict
 
 import sqlalchemy.orm.exc
 from hydra import log
 from hydra.rpc import BaseRPC
-from requests import RequestException
-from sqlalchemy import Column, String, Integer, desc, UniqueConstraint, and_, or_, asc, func
+from sqlalchemy import Column, String, Integer, desc, UniqueConstraint, and_, or_, asc, func, select, update, delete
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, load_only, lazyload
 
 from .base import *
 from .db import DB
+from .block_src import BlockSource
+from .headers import HeaderChain
 from ..api import schemas
 
 __all__ = "Block",
@@ -39,6 +44,7 @@ class Block(Base):
     conf = Column(Integer, nullable=False, index=True)
     info = DbInfoColumn()
     tx = DbDataColumn()
+    tx_addr = DbDataColumn()  # address -> indices into tx
 
     addr_hist = relationship(
         "AddrHist",
@@ -50,51 +56,57 @@ class Block(Base):
 
     CONF_MATURE = 2001
 
+    headers = HeaderChain()
+
+    @staticmethod
+    def load_light():
+        """Query options for the maintenance path: info, tx and addr_hist load lazily on first access.
+        """
+        return (
+            load_only(Block.pkid, Block.height, Block.hash, Block.conf),
+            lazyload(Block.addr_hist),
+        )
+
     def _removed_hist(self, db: DB):
         if not len(self.addr_hist):
             log.info(f"Deleting block #{self.height} with no history.")
             db.session.delete(self)
 
-    def on_new_block(self, db: DB, chain_height: int) -> bool:
-        info, txes = None, None
+    def on_new_block(self, db: DB, info: dict, txes: list, coalesce: Optional[set] = None) -> bool:
+        """Record history for watched addresses in this block.
 
-        while 1:
-            # noinspection PyBroadException
-            try:
-                info, txes = self.__get_block_info(db)
-                break
-            except BaseRPC.Exception as exc:
-                if exc.response.status_code == 404:
-                    # Block not in explorer yet, so wait for a little while.
-                    log.warning(f"Block #{self.height} not in explorer yet, trying again in 10s.")
-                    time.sleep(10)
-                    continue
+        With coalesce (a set, while catching up), address info is reconstructed from
+        this block's transactions instead of fetched, and the pkids of the addresses
+        involved are added to it for a single refresh once caught up. Addresses without
+        stored info, or with info from this height or later, are still fetched.
+        """
+        tx_addr = schemas.Block.tx_addr_index(txes)
 
-                log.error(f"RPC error querying explorer API: {str(exc)}. (Retrying in 30s)", exc_info=exc)
-                time.sleep(30)
-                continue
-            except BaseException as exc:
-                log.error(f"Error querying explorer API: {str(exc)}. (Retrying in 60s)", exc_info=exc)
-                time.sleep(60)
-                continue
+        self.conf = info["confirmations"]
+        # Copy without mutating, since fetched info is reused if Block.make() retries.
+        self.info = {k: v for k, v in info.items() if k != "confirmations"}
+        self.tx = txes
+        self.tx_addr = tx_addr
 
         addresses_hy = set()
         addresses_hx = set()
 
-        for tx in txes:
-            for address in schemas.Block.tx_yield_addrs(tx):
-                if len(address) == 34:
-                    addresses_hy.add(address)
-                elif len(address) == 40:
-                    addresses_hx.add(address)
-                else:
-                    log.warning(f"Unknown address length {len(address)}: '{address}'")
+        for address in tx_addr:
+            if len(address) == 34:
+                addresses_hy.add(address)
+            elif len(address) == 40:
+                addresses_hx.add(address)
+            else:
+                log.warning(f"Unknown address length {len(address)}: '{address}'")
+
+        from .addr import Addr
+
+        Addr.watch.refresh(db, max_age=Addr.watch.REFRESH_SECONDS)
+        addresses_hy, addresses_hx = Addr.watch.filter(addresses_hy, addresses_hx)
 
         if not len(addresses_hy) and not len(addresses_hx):
             return False
 
-        from .addr import Addr
-
         addrs: List[Addr] = db.session.query(
             Addr,
         ).where(
@@ -105,20 +117,45 @@ class Block(Base):
                     Addr.addr_hx.in_(addresses_hx),
                 )
             )
-        ).all()
+        ).populate_existing().all()  # Fresh attributes, since fetch_info() reads them from worker threads.
 
-        self.conf = info["confirmations"]
-        del info["confirmations"]
-        self.info = info
-        self.tx = txes
+        addrs = [addr for addr in addrs if len(addr.addr_users)]
+
+        coalesced = set()
+
+        if coalesce is not None:
+            # Info stored at this height or later already includes the block, so applying it again would count it twice.
+            coalesced = {addr.pkid for addr in addrs if addr.info and addr.block_h < self.height}
+            coalesce.update(coalesced)
 
-        added_history = False
+        # Only the network part runs concurrently, ORM changes are applied on this thread below.
+        fetched_rpc = iter(db.addr_pool.map(
+            lambda addr: addr.fetch_info(db), [addr for addr in addrs if addr.pkid not in coalesced]
+        ))
 
-        for addr in addrs:
-            added_history |= addr.on_block_create(db=db, block=self)
+        fetched = [
+            # block_h is left as-is so that Addr.refresh_all() fetches them afterwards.
+            (addr.block_h, addr.info_from_txes([
+                txes[i] for i in sorted(set(tx_addr.get(addr.addr_hy, ())) | set(tx_addr.get(addr.addr_hx, ())))
+            ]))
+            if addr.pkid in coalesced else next(fetched_rpc)
+            for addr in addrs
+        ]
 
-        if self.height == chain_height:
-            self.make_stat(db)
+        from .addr_hist import AddrHistBatch
+
+        batch = AddrHistBatch(self)
+
+        for addr, addr_fetched in zip(addrs, fetched):
+            addr.on_block_create(db=db, batch=batch, fetched=addr_fetched)
+
+        added_history = len(batch) > 0
+
+        if added_history:
+            db.session.add(self)
+            db.session.flush()
+            batch.insert(db)
+            self.sse_event_add(db, schemas.SSEBlockEvent.create, batch.hist_results())
 
         return added_history
 
@@ -143,49 +180,31 @@ class Block(Base):
             log.warning(f"Other Exception while adding new Stat entry: {exc}", exc_info=exc)
 
     def filter_tx(self, address: str):
-        return filter(lambda tx: address in list(schemas.Block.tx_yield_addrs(tx)), self.tx)
+        if self.tx_addr is not None:
+            return map(self.tx.__getitem__, self.tx_addr.get(address, ()))
 
-    def on_fork(self, db: DB, hash_new: str):
-        if self.hash == hash_new:
-            return
-
-        log.critical(f"Fork detected at height {self.height}: {self.hash} != {hash_new}")
-        log.error(f"Reverting {len(self.addr_hist)} addresses.")
+        return filter(lambda tx: address in schemas.Block.tx_addrs(tx), self.tx)
 
-        for addr_hist in self.addr_hist:
-            addr_hist.on_fork(db)
-
-        height = self.height
-
-        db.session.delete(self)
-        # Deletes all related addr_hist and user_addr_hist.
-        db.session.commit()
-
-        log.error(f"Re-processing block #{self.height}")
-
-        Block.make(
-            db=db,
-            height=height,
-            chain_height=-1,
-            block_hash=hash_new
-        )
-
-    def update_confirmations(self, db: DB):
-        block_hash = db.rpc.getblockhash(self.height)
+    def update_confirmations(self, db: DB, block_hash: Optional[str] = None, block_header: Optional[dict] = None):
+        if block_hash is None:
+            block_hash = db.rpc.getblockhash(self.height)
 
         if self.hash != block_hash:
-            self.on_fork(db, block_hash)
-            return
+            return  # No longer on the main chain, Block.update() rolls it back with Block.reorg().
 
-        try:
-            block_header = db.rpc.getblockheader(blockhash=self.hash)
-        except BaseRPC.Exception as exc:
-            log.warning(f"Block call to getblockheader() failed: {exc}", exc_info=exc)
-            return
+        if block_header is None:
+            try:
+                block_header = db.rpc.getblockheader(blockhash=self.hash)
+            except BaseRPC.Exception as exc:
+                log.warning(f"Block call to getblockheader() failed: {exc}", exc_info=exc)
+                return
 
-        conf = block_header.confirmations
+        self.update_conf(db, block_header.confirmations)
 
+    def update_conf(self, db: DB, conf: int):
         if conf >= Block.CONF_MATURE:
+            # The stored conf marks maturity as processed, so it fires exactly once even when the tip skips past it.
+            maturing = self.conf < Block.CONF_MATURE
 
             while 1:
                 try:
@@ -195,6 +214,9 @@ class Block(Base):
                         addr_hist.on_update_conf(db)
 
                     db.session.add(self)
+
+                    # Conf, maturity and the mature event in one transaction, so that neither is ever recorded without the other.
+                    self.update_conf_mature(db, maturing)
                     db.session.commit()
 
                     break
@@ -216,44 +238,47 @@ class Block(Base):
 
                         return False
 
-            try:
-                if self.update_confirmations_post_commit(db):
-                    db.session.commit()
+    def update_conf_mature(self, db: DB, maturing: bool) -> None:
+        """Part of update_conf() for a conf of at least Block.CONF_MATURE, without committing.
 
-            except sqlalchemy.exc.SQLAlchemyError as exc:
-                log.error(
-                    f"Block.update_confirmations(post-commit): Got SQL error '{exc}', not trying again.", exc_info=exc
-                )
-
-    def update_confirmations_post_commit(self, db: DB) -> bool:
-        """Called after bulk commit when update_confirmations() returned True.
+        A block is processed as mature once, on the update that first reached CONF_MATURE,
+        and deleted on any later one.
         """
-        if self.conf < Block.CONF_MATURE:
-            return False
-
-        if self.conf > Block.CONF_MATURE or not len(self.addr_hist):
+        if not maturing or not len(self.addr_hist):
             log.debug(f"Delete over-mature block #{self.height} with {self.conf} confirmations and {len(self.addr_hist)} hist entries.")
             db.session.delete(self)
-            return True
+            return
 
-        if self.conf == Block.CONF_MATURE:  # Decision: Only process when timing is right, to enable self deletion.
+        for addr_hist in self.addr_hist:
+            addr_hist.on_block_mature(db)
 
-            if len(self.addr_hist):
-                for addr_hist in self.addr_hist:
-                    addr_hist.on_block_mature(db)
+        self.sse_event_add(db, schemas.SSEBlockEvent.mature, self.addr_hist)
 
-                try:
-                    db.api.sse_block_notify_mature(block_pk=self.pkid)
-                except BaseRPC.Exception as exc:
-                    log.error(f"Unable to send block mature notify: response={exc.response} error={exc.error}", exc_info=exc)
-                except RequestException as exc:
-                    log.error(f"Unable to send block mature notify: request={exc.request} response={exc.response}", exc_info=exc)
-                except BaseException as exc:
-                    log.error(f"Unable to send block mature notify: {exc}", exc_info=exc)
-                else:
-                    log.debug(f"Sent notification for matured block #{self.pkid}")
-
-        return False
+    def sse_event_add(self, db: DB, event: schemas.SSEBlockEvent, hist: list) -> None:
+        """Write this block's SSE event to the outbox, to be committed with the caller's transaction.
+
+        The API only fans stored events out (see EventManager), so nothing is lost while it is down.
+        """
+        from .event import Event
+
+        result = self.sse_result(DbSequenceNext(db.session, Event.pkid.default.name, 1)[0], event, hist)
+
+        # noinspection PyArgumentList
+        db.session.add(Event(
+            pkid=result.id,
+            event="block",
+            data=result.model_dump_json(),
+        ))
+
+    def sse_result(self, pkid: int, event: schemas.SSEBlockEvent, hist: list) -> schemas.BlockSSEResult:
+        """The event payload, with the Event.pkid it is stored with as its id.
+        """
+        return schemas.BlockSSEResult(
+            id=pkid,
+            event=event,
+            block=self,
+            hist=hist,
+        )
 
     @staticmethod
     def update_confirmations_all(db: DB):
@@ -262,13 +287,44 @@ class Block(Base):
         while 1:
             blocks: List[Block] = db.session.query(
                 Block
+            ).options(
+                *Block.load_light()
             ).order_by(
                 asc(Block.height)
             ).all()
 
             try:
-                for block in blocks:
-                    block.update_confirmations(db)
+                # Blocks within the header chain are resolved from memory, with confirmations by height.
+                tip = Block.headers.height
+                on_main_chain = [Block.headers.on_main_chain(block.height, block.hash) for block in blocks]
+
+                for block, on_main in zip(blocks, on_main_chain):
+                    if on_main:
+                        block.update_conf(db, tip - block.height + 1)
+
+                # Older ones in a few batched round trips instead of two RPCs per block.
+                blocks = [block for block, on_main in zip(blocks, on_main_chain) if on_main is None]
+
+                block_hashes = db.rpc_batch("getblockhash", ((block.height,) for block in blocks))
+
+                block_headers = iter(db.rpc_batch(
+                    "getblockheader",
+                    ((block.hash,) for block, block_hash in zip(blocks, block_hashes) if block.hash == block_hash)
+                ))
+
+                for block, block_hash in zip(blocks, block_hashes):
+                    if block_hash is None:
+                        continue
+
+                    if block.hash != block_hash:
+                        continue  # Rolled back by Block.reorg() from Block.update().
+
+                    block_header = next(block_headers)
+
+                    if block_header is None:
+                        continue
+
+                    block.update_confirmations(db, block_hash=block_hash, block_header=block_header)
 
                 break
 
@@ -297,10 +353,38 @@ class Block(Base):
             return Block.make(db, height) # TODO FIX
 
     @staticmethod
-    def make(db: DB, height: int, chain_height: int, block_hash: Optional[str] = None) -> Optional[Block]:
+    def fetch(db: DB, height: int, block_hash: Optional[str] = None) -> Tuple[str, dict, list]:
+        """Fetch (hash, info, tx) for a block from the node and explorer, retrying until available.
+
+        Only uses RPC clients, never the session, so this is safe to run on a prefetch thread.
+        """
+        while 1:
+            # noinspection PyBroadException
+            try:
+                return Block.__get_block_info(db, height, block_hash)
+            except BaseRPC.Exception as exc:
+                if exc.response.status_code == 404:
+                    # Block not in explorer yet, so wait for a little while.
+                    log.warning(f"Block #{height} not in explorer yet, trying again in 10s.")
+                    time.sleep(10)
+                    continue
+
+                log.error(f"RPC error querying explorer API: {str(exc)}. (Retrying in 30s)", exc_info=exc)
+                time.sleep(30)
+                continue
+            except BaseException as exc:
+                log.error(f"Error querying explorer API: {str(exc)}. (Retrying in 60s)", exc_info=exc)
+                time.sleep(60)
+                continue
+
+    @staticmethod
+    def make(db: DB, height: int, chain_height: int, block_hash: Optional[str] = None, fetched: Optional[Tuple[str, dict, list]] = None, coalesce: Optional[set] = None) -> Optional[Block]:
         while 1:
             try:
-                bhash = db.rpc.getblockhash(height) if block_hash is None else block_hash
+                if fetched is None:
+                    fetched = Block.fetch(db, height, block_hash)
+
+                bhash, info, txes = fetched
 
                 # noinspection PyArgumentList
                 new_block: Block = Block(
@@ -308,23 +392,20 @@ class Block(Base):
                     hash=bhash,
                 )
 
-                if new_block.on_new_block(db, chain_height):
+                added_history = new_block.on_new_block(db, info, txes, coalesce=coalesce)
+
+                if added_history:
                     db.session.add(new_block)
-                    db.session.commit()
+                    db.session.commit()  # Block, history and its create event together.
                     db.session.refresh(new_block)
                     log.info(f"Processed block #{new_block.height}  chain: {chain_height}  hist: {len(new_block.addr_hist)}")
 
-                    try:
-                        db.api.sse_block_notify_create(block_pk=new_block.pkid)
-                    except BaseRPC.Exception as exc:
-                        log.error(f"Unable to send block notify: response={exc.response} error={exc.error}", exc_info=exc)
-                    except RequestException as exc:
-                        log.error(f"Unable to send block notify: request={exc.request} response={exc.response}", exc_info=exc)
-                    except BaseException as exc:
-                        log.error(f"Unable to send block notify: {exc}", exc_info=exc)
-                    else:
-                        log.debug(f"Sent notification for new block #{new_block.pkid}")
+                    ConfTracker.track(new_block)
 
+                if height == chain_height:
+                    new_block.make_stat(db)  # Every tip block, whether or not it is kept.
+
+                if added_history:
                     return new_block
 
             except sqlalchemy.orm.exc.StaleDataError as exc:
@@ -346,19 +427,24 @@ class Block(Base):
 
     @staticmethod
     def update_task(db: DB) -> None:
+        source = BlockSource.from_conf(db)
+
         try:
             with db.with_session():
                 Block.__update_init(db)
 
-                Block.update_confirmations_all(db)
+                ConfTracker.load(db)
 
                 while 1:
                     if Block.update(db):
-                        Block.update_confirmations_all(db)
-                    time.sleep(1)
+                        ConfTracker.on_tip(db)
+
+                    source.wait(LocalState.height)
 
         except KeyboardInterrupt:
             pass
+        finally:
+            source.close()
 
     @staticmethod
     def __update_init(db: DB) -> None:
@@ -375,6 +461,8 @@ class Block(Base):
             if LocalState.height == 0:
                 LocalState.height = db.rpc.getblockcount() - 1
 
+        Block.headers.load(db, LocalState.height, LocalState.hash or db.rpc.getblockhash(LocalState.height))
+
     @staticmethod
     def update(db: DB) -> bool:
 
@@ -383,35 +471,220 @@ class Block(Base):
 
         # log.debug(f"Poll: chain={chain_height} local={LocalState.height}")
 
-        if chain_height == LocalState.height:
-            if LocalState.hash and chain_hash != LocalState.hash:
-                log.warning(f"Fork detected at height {chain_height}: {chain_hash} != {LocalState.hash}")
-            else:
-                return False
+        if chain_height == LocalState.height and (not LocalState.hash or chain_hash == LocalState.hash):
+            return False
+
+        db.rpcc.invalidate(chain_height)
 
-        for height in range(LocalState.height + 1, chain_height + 1):
-            Block.make(db, height, chain_height)
+        height_start = LocalState.height + 1
+
+        ancestor_height = Block.headers.advance(db, chain_height, chain_hash)
+
+        if ancestor_height is not None and ancestor_height < LocalState.height:
+            ancestor_height, _ = Block.reorg(db, LocalState.height, LocalState.hash, ancestor_height)
+            height_start = ancestor_height + 1
+
+        from .addr import Addr
+
+        Addr.watch.refresh(db)
+
+        Block.make_range(db, height_start, chain_height)
 
         LocalState.height = chain_height
         LocalState.hash = chain_hash
 
         return True
 
-    def __get_block_info(self, db: DB):
+    @staticmethod
+    def reorg(db: DB, height: int, block_hash: str, ancestor_height: int = HeaderChain.UNKNOWN) -> Tuple[int, str]:
+        """Handle the local tip (height, block_hash) leaving the main chain.
+
+        Rolls back everything above the common ancestor and returns it as (height, hash),
+        so that the new branch can be ingested from the height after it. The ancestor
+        comes from Block.headers when known, otherwise from Block.find_ancestor().
+        """
+        ancestor_hash = Block.headers.hash_at(ancestor_height)
+
+        if ancestor_hash is None:
+            ancestor_height, ancestor_hash = Block.find_ancestor(db, block_hash)
+
+        log.critical(f"Chain reorganized: local tip #{height} {block_hash} is off the main chain, common ancestor is #{ancestor_height}.")
+
+        Block.rollback(db, ancestor_height)
+
+        return ancestor_height, ancestor_hash
+
+    @staticmethod
+    def find_ancestor(db: DB, block_hash: str) -> Tuple[int, str]:
+        """Walk back from a block that left the main chain to the last one still on it, by the node's stale headers.
+        """
+        try:
+            while 1:
+                header = db.rpc.getblockheader(blockhash=block_hash)
+
+                if header.confirmations >= 0:
+                    return header.height, block_hash
+
+                block_hash = header.previousblockhash
+
+        except BaseRPC.Exception as exc:
+            log.error(f"Unable to walk back from block {block_hash}, using stored blocks instead: {exc}")
+
+        # Without the stale branch, the best known ancestor is the highest stored block still on the main chain.
+        stored: List[Tuple[int, str]] = db.session.query(Block.height, Block.hash).order_by(desc(Block.height)).all()
+
+        for (height, block_hash), hash_now in zip(stored, db.rpc_batch("getblockhash", ((height,) for height, _ in stored))):
+            if block_hash == hash_now:
+                return height, block_hash
+
+        height = (stored[-1][0] if len(stored) else LocalState.height) - 1
+        return height, db.rpc.getblockhash(height)
+
+    @staticmethod
+    def rollback(db: DB, height: int) -> None:
+        """Delete all stored blocks above height in one transaction, with set-based SQL.
+
+        Each affected address gets the info from before its earliest rolled back history
+        entry, and each affected user address its block count and time from then.
+        History rows go with their blocks through ON DELETE CASCADE.
+        """
+        from .addr import Addr
+        from .addr_hist import AddrHist
+        from .user_addr import UserAddr
+        from .user_addr_hist import UserAddrHist
+
+        addr_old = select(
+            AddrHist.addr_pk, AddrHist.info_old
+        ).join(
+            Block, Block.pkid == AddrHist.block_pk
+        ).where(
+            Block.height > height
+        ).distinct(
+            AddrHist.addr_pk
+        ).order_by(
+            AddrHist.addr_pk, asc(Block.height)
+        ).subquery()
+
+        user_addr_old = select(
+            UserAddrHist.user_addr_pk, UserAddrHist.block_c, UserAddrHist.block_t
+        ).join(
+            AddrHist, AddrHist.pkid == UserAddrHist.addr_hist_pk
+        ).join(
+            Block, Block.pkid == AddrHist.block_pk
+        ).where(
+            Block.height > height
+        ).distinct(
+            UserAddrHist.user_addr_pk
+        ).order_by(
+            UserAddrHist.user_addr_pk, asc(Block.height)
+        ).subquery()
+
+        no_sync = {"synchronize_session": False}
+
+        while 1:
+            try:
+                addrs = db.session.execute(
+                    update(Addr).where(
+                        Addr.pkid == addr_old.c.addr_pk
+                    ).values(
+                        info=addr_old.c.info_old,
+                        block_h=height,
+                    ),
+                    execution_options=no_sync
+                ).rowcount
+
+                db.session.execute(
+                    update(UserAddr).where(
+                        UserAddr.pkid == user_addr_old.c.user_addr_pk
+                    ).values(
+                        block_c=user_addr_old.c.block_c,
+                        block_t=user_addr_old.c.block_t,
+                    ),
+                    execution_options=no_sync
+                )
+
+                blocks = db.session.execute(
+                    delete(Block).where(
+                        Block.height > height
+                    ),
+                    execution_options=no_sync
+                ).rowcount
+
+                db.session.commit()
+                break
+
+            except sqlalchemy.exc.SQLAlchemyError as exc:
+                log.error(f"Block.rollback(): Got SQL error '{exc}', trying again.", exc_info=exc)
+                db.session.rollback()
+                continue
+
+        db.session.expire_all()
+        log.error(f"Rolled back {blocks} block(s) above #{height}, reverting {addrs} address(es).")
+
+    @staticmethod
+    def make_range(db: DB, height_start: int, chain_height: int) -> None:
+        """Process blocks height_start..chain_height in strict height order.
+
+        When catching up, up to db.block_prefetch upcoming blocks are fetched
+        in the background while the current one is processed and committed.
+        Blocks at least db.block_coalesce behind the tip don't fetch address info;
+        it is fetched once at the end instead.
+        """
+        heights = iter(range(height_start, chain_height + 1))
+
+        if chain_height - height_start < 1 or db.block_prefetch < 1:
+            for height in heights:
+                Block.make(db, height, chain_height)
+            return
+
+        log.info(f"Catching up from block #{height_start} to #{chain_height} with prefetch depth {db.block_prefetch}.")
+
+        pool = ThreadPoolExecutor(max_workers=db.block_prefetch, thread_name_prefix="hydb-blk")
+        pending = deque()
+        coalesce = set()
+
+        try:
+            for height in islice(heights, db.block_prefetch):
+                pending.append((height, pool.submit(Block.fetch, db, height)))
+
+            while len(pending):
+                height, fetched = pending.popleft()
+
+                for height_next in islice(heights, 1):
+                    pending.append((height_next, pool.submit(Block.fetch, db, height_next)))
+
+                Block.make(
+                    db, height, chain_height, fetched=fetched.result(),
+                    coalesce=coalesce if chain_height - height >= db.block_coalesce else None
+                )
+
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        from .addr import Addr
+
+        try:
+            Addr.refresh_all(db, coalesce)
+        except sqlalchemy.exc.SQLAlchemyError as exc:
+            log.error(f"Block.make_range(): Got SQL error {exc} refreshing address info.", exc_info=exc)
+            db.session.rollback()
+
+    @staticmethod
+    def __get_block_info(db: DB, height: int, block_hash: Optional[str]) -> Tuple[str, dict, list]:
         while 1:
-            if self.hash is None:
-                self.hash = db.rpc.getblockhash(self.height)
+            if block_hash is None:
+                block_hash = db.rpc.getblockhash(height)
 
-            info = db.rpcx.get_block(self.height)
+            info = db.rpcx.get_block(height)
 
             if isinstance(info, str):
                 log.warning("get_block_info(): Explorer seems under maintenance, trying again in 30s.")
                 time.sleep(30)
                 continue
 
-            if info.height != self.height or info.hash != self.hash:
-                log.warning(f"Block info mismatch at height {self.height}/{self.hash} != {info.height}/{info.hash} -- retrying in 60s.")
-                self.hash = None
+            if info.height != height or info.hash != block_hash:
+                log.warning(f"Block info mismatch at height {height}/{block_hash} != {info.height}/{info.hash} -- retrying in 60s.")
+                block_hash = None
                 time.sleep(60)
                 continue
 
@@ -420,14 +693,83 @@ class Block(Base):
 
             tx = []
 
-            for txid in info.transactions:
-                trxn = db.rpcx.get_tx(txid)
-
+            # Fetch concurrently; map() yields results in the original transaction order.
+            for txid, trxn in zip(info.transactions, db.rpcx_pool.map(db.rpcx.get_tx, info.transactions)):
                 if isinstance(trxn, str):
-                    log.warning(f"get_block_info({self.height}:{txid}): Transaction could not load, skipping.")
+                    log.warning(f"get_block_info({height}:{txid}): Transaction could not load, skipping.")
                     continue
 
                 tx.append(trxn)
 
-            return info, tx
+            return block_hash, info, tx
+
+
+class ConfTracker:
+    """Track stored block confirmations by height arithmetic instead of asking the node per block.
+
+    Blocks on the main chain have tip - height + 1 confirmations, so each stored block
+    is queued to be due at the height where it matures (and again one height later,
+    when it becomes over-mature and is deleted). Only due blocks are loaded and updated.
+    Blocks removed by Block.reorg() are skipped when they come due.
+    """
+    due: List[Tuple[int, int, int]] = []  # heap of (due height, block pkid, block height)
+    due_at: Dict[int, int] = {}  # block pkid -> current due height, stale heap entries are skipped
+
+    @staticmethod
+    def due_height(height: int, conf: int) -> int:
+        return height + Block.CONF_MATURE - (1 if conf < Block.CONF_MATURE else 0)
+
+    @staticmethod
+    def push(pkid: int, height: int, conf: int) -> None:
+        due = ConfTracker.due_height(height, conf)
+        ConfTracker.due_at[pkid] = due
+        heapq.heappush(ConfTracker.due, (due, pkid, height))
+
+    @staticmethod
+    def track(block: Block) -> None:
+        ConfTracker.push(block.pkid, block.height, block.conf)
+
+    @staticmethod
+    def load(db: DB) -> None:
+        """Full pass over stored block maturity, then rebuild the due queue.
+        """
+        Block.update_confirmations_all(db)
+
+        ConfTracker.due = []
+        ConfTracker.due_at = {}
+
+        for pkid, height, conf in db.session.query(Block.pkid, Block.height, Block.conf).all():
+            ConfTracker.push(pkid, height, conf)
+
+        log.debug(f"Tracking confirmations for {len(ConfTracker.due_at)} blocks.")
+
+    @staticmethod
+    def on_tip(db: DB) -> None:
+        tip = LocalState.height
+
+        while len(ConfTracker.due) and ConfTracker.due[0][0] <= tip:
+            due, pkid, height = heapq.heappop(ConfTracker.due)
+
+            if ConfTracker.due_at.get(pkid, None) != due:
+                continue
+
+            del ConfTracker.due_at[pkid]
+
+            block: Optional[Block] = db.session.query(
+                Block
+            ).options(
+                *Block.load_light()
+            ).where(
+                Block.pkid == pkid
+            ).one_or_none()
+
+            if block is None:
+                continue  # Deleted since, e.g. after its last user address was removed.
+
+            if Block.headers.on_main_chain(height, block.hash) is False:
+                continue  # Off the main chain, Block.update() rolls it back with Block.reorg().
+
+            block.update_conf(db, tip - height + 1)
 
+            if block.conf >= Block.CONF_MATURE and sqlalchemy.inspect(block).persistent:
+                ConfTracker.push(pkid, height, block.conf)  # Matured, due again for deletion.
@@ -0,0 +1,143 @@
+"""New block arrival sources for Block.update_task().
+
+A source only signals that a new block may be available; Block.update()
+still determines the chain tip and processes the blocks.
+"""
+from __future__ import annotations
+
+import struct
+import time
+from abc import ABC, abstractmethod
+
+from hydra import log
+from hydra.rpc import BaseRPC
+from requests import RequestException
+
+from .db import DB
+
+__all__ = "BlockSource", "PollBlockSource", "LongPollBlockSource", "ZmqBlockSource", "ZmqBlockPublisher"
+
+
+class BlockSource(ABC):
+    POLL = "poll"
+    LONGPOLL = "longpoll"
+    ZMQ = "zmq"
+
+    @abstractmethod
+    def wait(self, height: int) -> None:
+        """Block until the chain may have moved past height, or a timeout elapses.
+        """
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def from_conf(db: DB) -> BlockSource:
+        kind = db.block_source
+
+        if kind == BlockSource.ZMQ:
+            try:
+                return ZmqBlockSource(db.block_source_url)
+            except ImportError as exc:
+                log.error(f"Block source 'zmq' needs pyzmq installed, falling back to long-poll: {exc}")
+                kind = BlockSource.LONGPOLL
+
+        if kind == BlockSource.LONGPOLL:
+            return LongPollBlockSource(db)
+
+        if kind != BlockSource.POLL:
+            log.warning(f"Unknown block source '{kind}', falling back to polling.")
+
+        return PollBlockSource()
+
+
+class PollBlockSource(BlockSource):
+    interval: float
+
+    def __init__(self, interval: float = 1):
+        self.interval = interval
+
+    def wait(self, height: int) -> None:
+        time.sleep(self.interval)
+
+
+class LongPollBlockSource(BlockSource):
+    """Long-poll the node with waitforblockheight, which returns as soon as the tip reaches height + 1.
+
+    The timeout bounds how long same-height forks can go unnoticed.
+    """
+    db: DB
+    timeout: int
+    poll: PollBlockSource
+
+    def __init__(self, db: DB, timeout: int = 30):
+        self.db = db
+        self.timeout = timeout
+        self.poll = PollBlockSource()
+
+    def wait(self, height: int) -> None:
+        try:
+            self.db.rpc.call("waitforblockheight", height + 1, self.timeout * 1000)
+        except (BaseRPC.Exception, RequestException) as exc:
+            log.warning(f"Long-poll waitforblockheight() failed, polling instead: {exc}")
+            self.poll.wait(height)
+
+
+class ZmqBlockSource(BlockSource):
+    """Subscribe to the node's ZMQ hashblock feed (-zmqpubhashblock=<url>).
+    """
+    TOPIC = b"hashblock"
+
+    url: str
+    timeout: int
+
+    def __init__(self, url: str, timeout: int = 30):
+        import zmq
+
+        self.url = url
+        self.timeout = timeout
+        self.__ctx = zmq.Context.instance()
+        self.__sock = self.__ctx.socket(zmq.SUB)
+        self.__sock.setsockopt(zmq.SUBSCRIBE, ZmqBlockSource.TOPIC)
+        self.__sock.connect(url)
+
+        log.info(f"Subscribed to hashblock feed at {url}")
+
+    def wait(self, height: int) -> None:
+        if not self.__sock.poll(self.timeout * 1000):
+            return
+
+        # Drain everything queued up, Block.update() catches up on all of it at once.
+        while self.__sock.poll(0):
+            topic, body, *_ = self.__sock.recv_multipart()
+            log.debug(f"ZMQ {topic.decode()}: {body.hex()}")
+
+    def close(self) -> None:
+        self.__sock.close(linger=0)
+
+
+class ZmqBlockPublisher:
+    """Local stand-in for the node's hashblock publisher, for running the ingester against ZMQ offline.
+    """
+    url: str
+    seq: int
+
+    def __init__(self, url: str):
+        import zmq
+
+        self.url = url
+        self.seq = 0
+        self.__sock = zmq.Context.instance().socket(zmq.PUB)
+        self.__sock.bind(url)
+
+    def publish(self, block_hash: str) -> None:
+        self.__sock.send_multipart([
+            ZmqBlockSource.TOPIC,
+            bytes.fromhex(block_hash),
+            struct.pack("<I", self.seq),
+        ])
+
+        self.seq += 1
+
+    def close(self) -> None:
+        self.__sock.close(linger=0)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from attrdict import AttrDict
+from sqlalchemy import Column, String, Enum, Integer, Numeric, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm.attributes import set_committed_value
+
+from hydra import log
+from hydra.rpc import BaseRPC
+
+from .base import *
+from .db import DB
+from .addr import Addr
+
+__all__ = "Contract",
+
+
+class Contract(Base):
+    """Token contract metadata from Addr.validate_contract().
+
+    Type, name, symbol and decimals don't change and are kept permanently, while
+    totalSupply is refreshed at most once per chain tip when read.
+
+    Writes go through their own transaction on the engine, so reads from inside
+    another operation never commit or roll back the caller's session.
+    """
+    __tablename__ = "contract"
+
+    addr_hx = Column(String(40), nullable=False, primary_key=True)
+    addr_tp = Column(Enum(Addr.Type, validate_strings=True), nullable=False)
+    name = Column(String, nullable=False)
+    symbol = Column(String, nullable=True)
+    decimals = Column(Integer, nullable=True)
+    total_supply = Column(Numeric(78, 0), nullable=True)  # uint256
+    supply_h = Column(Integer, nullable=False, default=-1)
+
+    def sci(self) -> AttrDict:
+        """Metadata in the form validate_contract() has always returned.
+        """
+        sci = AttrDict(name=self.name)
+
+        if self.symbol is not None:
+            sci.symbol = self.symbol
+
+        if self.total_supply is not None:
+            sci.totalSupply = int(self.total_supply)
+
+        if self.decimals is not None:
+            sci.decimals = self.decimals
+
+        return sci
+
+    def refresh_supply(self, db: DB) -> None:
+        if self.total_supply is None:
+            return
+
+        block_height = db.rpcc.getblockcount()
+
+        if self.supply_h >= block_height:
+            return
+
+        try:
+            r = db.rpc.callcontract(self.addr_hx, Addr.ContractMethodID.totalSupply)
+        except BaseRPC.Exception as exc:
+            log.warning(f"Contract totalSupply refresh failed for {self.addr_hx}: {exc}")
+            return
+
+        if r.executionResult.excepted != "None":
+            return
+
+        total_supply = int(r.executionResult.output, 16)
+
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(Contract).where(
+                    Contract.addr_hx == self.addr_hx
+                ).values(
+                    total_supply=total_supply,
+                    supply_h=block_height,
+                )
+            )
+
+        set_committed_value(self, "total_supply", total_supply)
+        set_committed_value(self, "supply_h", block_height)
+
+    @staticmethod
+    def get(db: DB, addr_hx: str) -> Optional[Contract]:
+        contract: Optional[Contract] = db.session.get(Contract, addr_hx)
+
+        if contract is not None:
+            contract.refresh_supply(db)
+
+        return contract
+
+    @staticmethod
+    def add(db: DB, addr_hx: str, addr_tp: Addr.Type, sci: AttrDict) -> Contract:
+        values = dict(
+            addr_hx=addr_hx,
+            addr_tp=addr_tp,
+            name=sci.name,
+            symbol=sci.get("symbol", None),
+            decimals=sci.get("decimals", None),
+            total_supply=sci.get("totalSupply", None),
+            supply_h=db.rpcc.getblockcount(),
+        )
+
+        with db.engine.begin() as conn:
+            conn.execute(insert(Contract).values(**values).on_conflict_do_nothing())
+
+        return db.session.get(Contract, addr_hx) or Contract(**values)
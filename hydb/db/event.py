@@ -1,123 +1,134 @@
 from __future__ import annotations
 
-from typing import List, Optional
+from typing import List, Optional, Collection
 
 from datetime import datetime, timedelta
 
 from hydra import log
-from sqlalchemy import Column, String, DateTime, func, event as sa_event, and_, Text, not_
+from sqlalchemy import Column, String, DateTime, Integer, func, event as sa_event, and_, Text, text, delete
+from sqlalchemy.dialects.postgresql import insert
 
 from .base import *
 from .db import DB
 
-__all__ = "Event",
+__all__ = "Event", "EventCursor"
 
 
 class Event(Base):
     __tablename__ = "event"
-    __table_args__ = (
-        DbInfoColumnIndex(__tablename__, "claim"),
-    )
 
-    __LISTENERS = {}
+    CHANNEL = "hydb_event"  # NOTIFY channel, payload "<event>:<pkid>"
 
     pkid = DbPkidColumn(seq="event_seq")
     date_create = DbDateCreateColumn()
     date_expire = Column(DateTime, nullable=False, default=lambda: datetime.utcnow() + timedelta(hours=18))
-    claim = DbInfoColumn(default=[])
+    claim = DbInfoColumn(default=[])  # No longer used since EventCursor, kept for existing tables.
     event = Column(String, nullable=False)
     data = Column(Text, nullable=False)
 
     @staticmethod
-    def insert_listener_add(db, callback):
-        @sa_event.listens_for(Event, 'after_insert')
-        def event_after_insert(mapper, connection, target):
-            if target is None:
-                log.warning("event_after_insert(): target is None.")
-                return
-
-            @sa_event.listens_for(db.session, 'after_flush', once=True)
-            def event_after_insert_flush(session, flush_context):
-                Event._insert_listener_call(session, target, callback)
-
-        Event.__LISTENERS[callback] = event_after_insert
-
-    @staticmethod
-    def insert_listener_rem(callback):
-        del Event.__LISTENERS[callback]
-
-    @staticmethod
-    def _insert_listener_call(session, target, callback):
-        # noinspection PyBroadException
-        try:
-            callback(session, target)
-        except BaseException as exc:
-            log.critical("Event insert listener callback error", exc_info=exc)
+    def read_after(db: DB, event: str, pkid: int, limit: Optional[int] = None, before: Optional[int] = None, exclude: Collection[int] = ()) -> List[Event]:
+        """Events with pkid after the given one (and before `before`, if given) in pkid order, except those in exclude.
 
-        Event.delete_expired(session)
-
-    def claim_for(self, claimant: str) -> bool:
-        if claimant in self.claim:
-            return False
-
-        self.claim.append(claimant)
-        return True
-
-    @staticmethod
-    def claim_all_for(db: DB, event: str, claimant: str, limit: Optional[int] = None) -> List[Event]:
+        Keyset read on the primary key; events themselves are never written to.
+        """
         q = db.session.query(
             Event
         ).filter(
             and_(
                 Event.event == event,
-                not_(
-                    Event.claim.op("?")(claimant)
-                )
+                Event.pkid > pkid,
             )
-        ).order_by(
+        )
+
+        if before is not None:
+            q = q.filter(Event.pkid < before)
+
+        if len(exclude):
+            q = q.filter(Event.pkid.not_in(exclude))
+
+        q = q.order_by(
             Event.pkid
         )
 
         if limit is not None:
             q = q.limit(limit)
 
-        events: List[Event] = q.all()
+        return q.all()
+
+    @staticmethod
+    def read_latest(db: DB, event: str, limit: int) -> List[Event]:
+        """The last limit events in pkid order.
+        """
+        return list(reversed(
+            db.session.query(
+                Event
+            ).filter(
+                Event.event == event
+            ).order_by(
+                Event.pkid.desc()
+            ).limit(limit).all()
+        ))
+
+
+@sa_event.listens_for(Event, "after_insert")
+def _event_after_insert(mapper, connection, target: Event):
+    # Delivered to every listening process when the inserting transaction commits.
+    connection.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": Event.CHANNEL, "payload": f"{target.event}:{target.pkid}"}
+    )
 
-        if len(events):
-            for event in events:
-                event.claim_for(claimant)
+    deleted = connection.execute(
+        delete(Event.__table__).where(func.now() >= Event.date_expire)
+    ).rowcount
 
-            db.session.commit()
+    if deleted:
+        log.info(f"Deleted {deleted} expired events.")
 
-            for event in events:
-                db.session.refresh(event)
 
-        return events
+class EventCursor(Base):
+    """Last event delivered to a consumer, per event type.
+
+    The position is a pkid, which assumes events commit in pkid order: true for the
+    ingester, their only producer, which allocates and commits them one transaction
+    at a time. An event committing after the cursor passed its pkid is not delivered
+    on resume; streams catch those within EventManager.BlockHub.LOOKBACK.
+    """
+    __tablename__ = "event_cursor"
+
+    consumer = Column(String, nullable=False, primary_key=True)
+    event = Column(String, nullable=False, primary_key=True)
+    pkid = Column(Integer, nullable=False, default=0)
+    date_update = DbDateUpdateColumn()
 
     @staticmethod
-    def unclaimed_for(db: DB, claimant: str) -> List[Event]:
+    def position(db: DB, consumer: str, event: str) -> int:
+        """Last event pkid delivered to consumer; new consumers start at 0 and receive all unexpired events.
+        """
         return db.session.query(
-            Event
-        ).filter(
-            not_(
-                Event.claim.op("?")(claimant)
+            EventCursor.pkid
+        ).where(
+            and_(
+                EventCursor.consumer == consumer,
+                EventCursor.event == event,
             )
-        ).order_by(
-            Event.pkid
-        ).all()
+        ).scalar() or 0
 
     @staticmethod
-    def delete_expired(session):
-        deleted: int = session.query(
-            Event
-        ).filter(
-            func.now() >= Event.date_expire
-        ).delete(
-            synchronize_session="fetch"
+    def advance(db: DB, consumer: str, event: str, pkid: int) -> None:
+        """Move the consumer's cursor forward to pkid, never backwards.
+        """
+        stmt = insert(EventCursor).values(consumer=consumer, event=event, pkid=pkid)
+
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[EventCursor.consumer, EventCursor.event],
+                set_={
+                    "pkid": func.greatest(EventCursor.pkid, stmt.excluded.pkid),
+                    "date_update": func.now(),
+                }
+            )
         )
 
-        if deleted:
-            log.info(f"Deleted {deleted} expired events.")
-            # Causes later error "This transaction is closed":
-            # session.commit()
-
+        db.session.commit()
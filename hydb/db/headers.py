@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Optional, Deque
+
+from hydra import log
+
+from .db import DB
+
+__all__ = "HeaderChain",
+
+
+class HeaderChain:
+    """The last few thousand block hashes of the best chain as seen by the ingester, by height.
+
+    Entries are contiguous, so each one's prevhash is the entry before it. Updated
+    incrementally from new tips with batched getblockhash calls, it answers whether
+    a stored block is still on the main chain from memory, and reports the common
+    ancestor as soon as a new tip's ancestry no longer includes the recorded tip.
+    """
+    UNKNOWN = -1
+
+    size: int
+    base: int  # height of hashes[0]
+    hashes: Deque[str]
+
+    def __init__(self):
+        self.size = 0
+        self.base = 0
+        self.hashes = deque()
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def height(self) -> int:
+        """Height of the recorded tip, or base - 1 when empty.
+        """
+        return self.base + len(self.hashes) - 1
+
+    def hash_at(self, height: int) -> Optional[str]:
+        if self.base <= height <= self.height:
+            return self.hashes[height - self.base]
+
+        return None
+
+    def on_main_chain(self, height: int, block_hash: str) -> Optional[bool]:
+        """Whether (height, block_hash) is on the recorded chain, or None when height is outside of it.
+        """
+        hash_at = self.hash_at(height)
+        return None if hash_at is None else hash_at == block_hash
+
+    def load(self, db: DB, height: int, block_hash: str) -> None:
+        """Record the node's hashes for the window ending at height, with block_hash (e.g. the local tip) as its tip.
+
+        The node's hashes below height are only the local chain's if block_hash is still on the node's chain.
+        Otherwise (e.g. a reorg while stopped) the window starts at the tip alone, and the next advance()
+        reports the reorg with HeaderChain.UNKNOWN, leaving the ancestor to Block.find_ancestor().
+        """
+        self.size = db.header_chain_size
+        self.base = max(0, height - self.size + 1)
+        self.hashes = deque(db.rpc_batch("getblockhash", ((h,) for h in range(self.base, height + 1))), maxlen=self.size)
+
+        if self.hashes[-1] != block_hash or None in self.hashes:
+            log.warning(f"Header chain: #{height} {block_hash} could not be verified on the node's chain, starting from the tip only.")
+            self.base = height
+            self.hashes = deque((block_hash,), maxlen=self.size)
+
+    def advance(self, db: DB, chain_height: int, chain_hash: str) -> Optional[int]:
+        """Extend to the node's new tip. Returns None, or if the recorded tip left the main chain,
+        the height of the common ancestor (HeaderChain.UNKNOWN when older than the recorded window).
+        """
+        tip_height, tip_hash = self.height, self.hash_at(self.height)
+
+        if chain_height > tip_height:
+            heights = range(tip_height + 1, chain_height)
+            new_hashes = db.rpc_batch("getblockhash", ((h,) for h in heights)) + [chain_hash]
+
+            if None not in new_hashes and db.rpc.getblockheader(blockhash=new_hashes[0]).previousblockhash == tip_hash:
+                self.__extend(new_hashes)
+                return None
+
+        elif chain_height == tip_height and chain_hash == tip_hash:
+            return None
+
+        # The recorded tip is no longer in the chain, find where it diverged.
+        top = min(tip_height, chain_height)
+        node_hashes = db.rpc_batch("getblockhash", ((h,) for h in range(self.base, top + 1)))
+
+        for height in range(top, self.base - 1, -1):
+            if node_hashes[height - self.base] == self.hash_at(height):
+                break
+        else:
+            log.warning(f"Header chain: no common ancestor within the last {len(self)} blocks.")
+            self.load(db, chain_height, chain_hash)
+            return HeaderChain.UNKNOWN
+
+        for _ in range(tip_height - height):
+            self.hashes.pop()
+
+        if chain_height > height:  # Otherwise the node's tip moved back onto the ancestor itself.
+            self.__extend(db.rpc_batch("getblockhash", ((h,) for h in range(height + 1, chain_height))) + [chain_hash])
+
+        log.warning(f"Header chain: reorg of depth {tip_height - height} below #{tip_height}, common ancestor #{height}.")
+        return height
+
+    def __extend(self, new_hashes: list) -> None:
+        if None in new_hashes:
+            # The chain moved while fetching; keep the contiguous part, the next advance() continues from it.
+            new_hashes = new_hashes[:new_hashes.index(None)]
+
+        for block_hash in new_hashes:
+            if len(self.hashes) == self.size:
+                self.base += 1
+
+            self.hashes.append(block_hash)
@@ -36,7 +36,7 @@ class BlockStat(StatBase, Base):
     tx_count = Column(SmallInteger, nullable=False)
 
     def __init__(self, db: DB, block: Block, **kwds):
-        rpc_block = db.rpc.getblock(block.hash)
+        rpc_block = db.rpcc.getblock(block.hash)
         info = AttrDict(block.info)
 
         super().__init__(
@@ -56,18 +56,19 @@ class Stat(StatBase, Base):
     def __init__(self, db: DB, block: Block):
 
         while 1:
-            info = db.rpc.getinfo()
+            info = db.rpcc.getinfo()
 
             if Decimal(info.moneysupply) == 0 or Decimal(info.burnedcoins) == 0:
                 log.warning("Hydra RPC getinfo() returnd zero values, retrying.")
+                db.rpcc.forget("getinfo")
                 time.sleep(1)
                 continue
 
             break
 
-        mining_info = db.rpc.getmininginfo()
+        mining_info = db.rpcc.getmininginfo()
 
-        apr = db.rpc.getestimatedannualroi()
+        apr = db.rpcc.getestimatedannualroi()
 
         # noinspection PyArgumentList
         super().__init__(
@@ -2,7 +2,7 @@ from __future__ import annotations
 from typing import Optional, Union
 
 from attrdict import AttrDict
-from deepdiff import DeepDiff
+from ..util.jsoncmp import json_changed
 
 from sqlalchemy import Column, Integer, BigInteger
 from sqlalchemy.exc import IntegrityError
@@ -130,14 +130,14 @@ class User(Base):
         changed = False
 
         if update.over:
-            if DeepDiff(dict(self.info), dict(update.info)):
+            if json_changed(dict(self.info), dict(update.info)):
                 self.info = update.info
                 changed = True
         else:
             info = dict(self.info)
             info.update(update.info)
 
-            if DeepDiff(dict(self.info), info):
+            if json_changed(dict(self.info), info):
                 self.info = info
                 changed = True
 
@@ -11,7 +11,7 @@ from sqlalchemy.orm import relationship
 from .base import *
 from .db import DB
 from .addr import Addr
-from .addr_hist import AddrHist
+from .addr_hist import AddrHistBatch
 from .user_addr_hist import UserAddrHist
 
 from ..util import namegen
@@ -75,18 +75,11 @@ class UserAddr(Base):
         db.session.commit()
         return True
 
-    def on_new_addr_hist(self, db: DB, addr_hist: AddrHist):
-        user_addr_hist = UserAddrHist(
-            user_addr=self,
-            addr_hist=addr_hist,
-            block_t=self.block_t,
-            block_c=self.block_c,
-        )
+    def on_new_addr_hist(self, db: DB, batch: AddrHistBatch, hist: int):
+        batch.add_user(hist, self)
 
-        db.session.add(user_addr_hist)
-
-        if addr_hist.mined:
-            self.block_t = datetime.utcfromtimestamp(addr_hist.block.info.get("timestamp"))
+        if batch.mined(hist):
+            self.block_t = datetime.utcfromtimestamp(batch.block.info.get("timestamp"))
             self.block_c += 1
 
             if self.info.get("v", None) is not None:
@@ -109,11 +102,6 @@ class UserAddr(Base):
         user_addrs.remove(self)
         addr._removed_user(db)
 
-    def on_fork(self, db: DB, user_addr_hist: UserAddrHist):
-        self.block_c = user_addr_hist.block_c
-        self.block_t = user_addr_hist.block_t
-        db.session.add(self)
-
     @staticmethod
     def get_by_addr(db: DB, user, addr: Addr, create: Union[bool, str] = True) -> Optional[UserAddr]:
         try:
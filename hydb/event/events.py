@@ -1,5 +1,6 @@
-from asyncio import Semaphore
-from typing import Optional, List
+import asyncio
+from collections import deque
+from typing import Optional, List, Callable, Set, Deque, Tuple
 
 from fastapi import Request
 
@@ -8,81 +9,280 @@ from sse_starlette import ServerSentEvent
 
 from hydb.db import DB
 import hydb.db as models
-from hydb.api import schemas
 
 from . import Events
 
 
 class EventManager:
 
+    class Listener:
+        """One LISTEN connection per process, fanning Event NOTIFYs out to subscribers on the event loop.
+
+        Wakes up for inserts from any process (other API workers, the ingester), not only this one.
+        """
+        subscribers: Set[Callable[[str, int], None]] = set()
+        conn = None
+        loop: Optional[asyncio.AbstractEventLoop] = None
+
+        @staticmethod
+        def subscribe(db: DB, callback: Callable[[str, int], None]) -> None:
+            EventManager.Listener.subscribers.add(callback)
+            EventManager.Listener.ensure(db)
+
+        @staticmethod
+        def unsubscribe(callback: Callable[[str, int], None]) -> None:
+            EventManager.Listener.subscribers.discard(callback)
+
+        @staticmethod
+        def ensure(db: DB) -> None:
+            """Start listening on the running event loop if not already."""
+            if EventManager.Listener.conn is not None:
+                return
+
+            raw = db.engine.raw_connection()
+            raw.detach()  # Dedicated to LISTEN, never returned to the pool.
+            conn = raw.connection
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {models.Event.CHANNEL}")
+
+            loop = asyncio.get_running_loop()
+            loop.add_reader(conn.fileno(), EventManager.Listener.__on_readable)
+
+            EventManager.Listener.conn = conn
+            EventManager.Listener.loop = loop
+            log.info(f"Listening for events on channel '{models.Event.CHANNEL}'.")
+
+        @staticmethod
+        def __on_readable() -> None:
+            conn = EventManager.Listener.conn
+
+            try:
+                conn.poll()
+            except Exception as exc:
+                log.error(f"Event listener connection lost, reconnecting on next wait: {exc}")
+                EventManager.Listener.loop.remove_reader(conn.fileno())
+                EventManager.Listener.conn = None
+                conn.close()
+                notifies = [(None, 0)]  # Wake everyone up to re-read.
+            else:
+                notifies = []
+
+                while conn.notifies:
+                    event, _, pkid = conn.notifies.pop(0).payload.partition(":")
+                    notifies.append((event, int(pkid or 0)))
+
+            for event, pkid in notifies:
+                for callback in list(EventManager.Listener.subscribers):
+                    callback(event, pkid)
+
+    class BlockHub:
+        """Ring buffer of the last SIZE block events in pkid order, encoded once as ready-to-send SSE bytes.
+
+        Shared by every stream in this process: each new event is read from the DB
+        and serialized once, and subscribers only keep their own offset into it.
+
+        Reads are keyset reads by pkid, which assumes events commit in pkid order (see
+        EventCursor). As a safeguard, each refresh also re-checks the last LOOKBACK pkids
+        for events that committed late, and streams skip what they already sent.
+        """
+        SIZE = 1024
+        RETRY = 30000
+        LOOKBACK = 64
+
+        entries: Deque[Tuple[int, bytes]] = deque(maxlen=SIZE)  # (Event.pkid, encoded)
+        last: Optional[int] = None
+        lock: Optional[asyncio.Lock] = None
+
+        @staticmethod
+        def encode(event: models.Event) -> bytes:
+            return ServerSentEvent(
+                id=str(event.pkid),
+                event=Events.EventType.BLOCK,
+                retry=EventManager.BlockHub.RETRY,
+                data=event.data,
+            ).encode()
+
+        @staticmethod
+        async def refresh(db: DB) -> None:
+            """Load events inserted since the last refresh, once for all subscribers.
+            """
+            hub = EventManager.BlockHub
+
+            if hub.lock is None:
+                hub.lock = asyncio.Lock()
+
+            async with hub.lock:
+                if hub.last is None:
+                    events = await db.in_session_async(models.Event.read_latest, db, Events.EventType.BLOCK, hub.SIZE)
+                else:
+                    after = hub.last - hub.LOOKBACK
+                    known = [pkid for pkid, _ in hub.entries if pkid > after]
+
+                    events = await db.in_session_async(
+                        models.Event.read_after, db, Events.EventType.BLOCK, after, None, None, known
+                    )
+
+                for event in events:
+                    hub.__insert(event.pkid, hub.encode(event))
+
+                hub.last = max([hub.last or 0] + [event.pkid for event in events])
+
+        @staticmethod
+        def __insert(pkid: int, encoded: bytes) -> None:
+            entries = EventManager.BlockHub.entries
+
+            if not len(entries) or pkid > entries[-1][0]:
+                entries.append((pkid, encoded))
+                return
+
+            # Committed after events with higher pkids, keep the buffer ordered.
+            log.warning(f"Block event #{pkid} committed out of pkid order.")
+            i = len(entries)
+
+            while i and entries[i - 1][0] > pkid:
+                i -= 1
+
+            if len(entries) == entries.maxlen:
+                if not i:
+                    return  # Older than the whole buffer, since() reads it from the DB.
+
+                entries.popleft()
+                i -= 1
+
+            entries.insert(i, (pkid, encoded))
+
+        @staticmethod
+        async def since(db: DB, pkid: int, limit: Optional[int] = None) -> List[Tuple[int, bytes]]:
+            """Encoded events after pkid, from the buffer and, for what's older than it, from the DB.
+            """
+            hub = EventManager.BlockHub
+            result = []
+
+            for entry in reversed(hub.entries):
+                if entry[0] <= pkid:
+                    break
+
+                result.append(entry)
+
+            result.reverse()
+
+            oldest = hub.entries[0][0] if len(hub.entries) else None
+
+            if oldest is None or (len(result) == len(hub.entries) and pkid < oldest - 1):
+                events = await db.in_session_async(
+                    models.Event.read_after, db, Events.EventType.BLOCK, pkid, limit, oldest
+                )
+
+                result = [(event.pkid, hub.encode(event)) for event in events] + result
+
+            return result if limit is None else result[:limit]
+
     class BlockLoader:
-        claimant: str
+        WAIT_TIMEOUT = 30  # Re-read anyway after this long, in case a notification was missed.
+
+        consumer: str
         db: DB
-        sem: Semaphore
+        ready: asyncio.Event
+        offset: Optional[int]
+        floor: Optional[int]
+        sent: Set[int]
 
-        def __init__(self, db: DB, claimant: str):
+        def __init__(self, db: DB, consumer: str, offset: Optional[int] = None):
             self.db = db
-            self.claimant = claimant
-            self.sem = Semaphore(value=1)
+            self.consumer = consumer
+            self.ready = asyncio.Event()
+            self.ready.set()  # Deliver the backlog first.
+            self.offset = offset  # Resume point, otherwise the consumer's cursor.
+            self.floor = None  # Everything up to here counts as delivered.
+            self.sent = set()  # Delivered pkids above floor, within BlockHub.LOOKBACK of offset.
 
-        def __event_insert_callback(self, _, target: models.Event):
-            if Events.event_is_block(target.event):
-                self.sem.release()
+        def __event_notify_callback(self, event: Optional[str], _: int):
+            if event is None or Events.event_is_block(event):
+                self.ready.set()
 
         def __enter__(self):
-            models.Event.insert_listener_add(self.db, self.__event_insert_callback)
+            EventManager.Listener.subscribe(self.db, self.__event_notify_callback)
             return self
 
         def __exit__(self, exc_type, exc_val, exc_tb):
-            models.Event.insert_listener_rem(self.__event_insert_callback)
+            EventManager.Listener.unsubscribe(self.__event_notify_callback)
 
         async def wait(self):
-            await self.sem.acquire()
-
-        async def next(self, limit: Optional[int] = None) -> List[schemas.BlockSSEResult]:
-            return await self.db.in_session_async(self.__load_block_events, limit)
-
-        def __load_block_events(self, limit: Optional[int]):
-            return [
-                Events.block_event_decode(event.data)
-                for event in
-                models.Event.claim_all_for(
-                    db=self.db,
-                    event=Events.EventType.BLOCK,
-                    claimant=self.claimant,
-                    limit=limit
+            try:
+                await asyncio.wait_for(self.ready.wait(), EventManager.BlockLoader.WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                try:
+                    EventManager.Listener.ensure(self.db)
+                except Exception as exc:
+                    log.error(f"Unable to listen for events, polling instead: {exc}")
+
+            self.ready.clear()
+
+        async def next(self, limit: Optional[int] = None) -> List[Tuple[int, bytes]]:
+            if self.offset is None:
+                self.offset = await self.db.in_session_async(
+                    models.EventCursor.position, self.db, self.consumer, Events.EventType.BLOCK
                 )
-            ]
+
+            if self.floor is None:
+                self.floor = self.offset
+
+            await EventManager.BlockHub.refresh(self.db)
+
+            entries = await EventManager.BlockHub.since(
+                self.db,
+                max(self.floor, self.offset - EventManager.BlockHub.LOOKBACK),
+                None if limit is None else limit + len(self.sent)
+            )
+
+            entries = [entry for entry in entries if entry[0] not in self.sent]
+            return entries if limit is None else entries[:limit]
+
+        async def ack(self, pkids: List[int]) -> None:
+            """Record delivery of pkids, for this stream and the consumer's cursor.
+            """
+            self.sent.update(pkids)
+            self.offset = max([self.offset] + pkids)
+            self.floor = max(self.floor, self.offset - EventManager.BlockHub.LOOKBACK)
+            self.sent = {pkid for pkid in self.sent if pkid > self.floor}
+
+            await self.db.in_session_async(
+                models.EventCursor.advance, self.db, self.consumer, Events.EventType.BLOCK, self.offset
+            )
+
+    @staticmethod
+    def last_event_id(request: Request) -> Optional[int]:
+        """The Last-Event-ID a reconnecting client sent (event ids are Event.pkid), if valid.
+        """
+        last_event_id = request.headers.get("last-event-id", None)
+
+        try:
+            return int(last_event_id) if last_event_id is not None else None
+        except ValueError:
+            log.warning(f"Ignoring invalid Last-Event-ID '{last_event_id}' from {request.client.host}.")
+            return None
 
     @staticmethod
     async def block_event_generator(db: DB, request: Request, limit: Optional[int] = None):
-        claimant = request.client.host
+        consumer = request.client.host
         sent = 0
 
-        with EventManager.BlockLoader(db=db, claimant=claimant) as block_loader:
+        with EventManager.BlockLoader(db=db, consumer=consumer, offset=EventManager.last_event_id(request)) as block_loader:
             while 1:
                 if await request.is_disconnected():
                     break
 
                 await block_loader.wait()
 
-                block_sse_results = await block_loader.next(limit=limit)
-
-                for block_sse_result in block_sse_results:
-
-                    yield ServerSentEvent(
-                        id=block_sse_result.id,
-                        event=Events.EventType.BLOCK,
-                        retry=30000,
-                        data=block_sse_result.json(encoder=str)
-                    )
+                entries = await block_loader.next(limit=None if limit is None else limit - sent)
 
+                for pkid, encoded in entries:
+                    yield encoded
                     sent += 1
 
-                    log.debug(
-                        f"Sent {block_sse_result.event} event for block #{block_sse_result.block.height} to {claimant}."
-                    )
-
-                    if limit is not None and sent >= limit:
-                        return
+                if len(entries):
+                    await block_loader.ack([pkid for pkid, _ in entries])
+                    log.debug(f"Sent {len(entries)} block event(s) up to #{block_loader.offset} to {consumer}.")
 
+                if limit is not None and sent >= limit:
+                    return
@@ -0,0 +1,92 @@
+"""Base58check codec for HYDRA addresses, mirroring the node's validateaddress/gethexaddress/fromhexaddress.
+"""
+import hashlib
+from typing import Tuple
+
+__all__ = (
+    "ALPHABET", "P2PKH_MAINNET", "P2PKH_TESTNET",
+    "b58encode", "b58decode", "b58check_encode", "b58check_decode",
+    "p2pkh_version", "address_to_hex", "hex_to_address",
+)
+
+ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+
+P2PKH_MAINNET = 40  # 'H...'
+P2PKH_TESTNET = 66  # 'T...'
+
+
+def b58encode(data: bytes) -> str:
+    zeros = len(data) - len(data.lstrip(b"\0"))
+    num = int.from_bytes(data, "big")
+    out = []
+
+    while num:
+        num, rem = divmod(num, 58)
+        out.append(ALPHABET[rem])
+
+    return ALPHABET[0] * zeros + "".join(reversed(out))
+
+
+def b58decode(text: str) -> bytes:
+    num = 0
+
+    for c in text:
+        try:
+            num = num * 58 + _INDEX[c]
+        except KeyError:
+            raise ValueError(f"Invalid base58 character '{c}'")
+
+    zeros = len(text) - len(text.lstrip(ALPHABET[0]))
+    return b"\0" * zeros + num.to_bytes((num.bit_length() + 7) // 8, "big")
+
+
+def _checksum(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()[:4]
+
+
+def b58check_encode(version: int, payload: bytes) -> str:
+    data = bytes((version,)) + payload
+    return b58encode(data + _checksum(data))
+
+
+def b58check_decode(text: str) -> Tuple[int, bytes]:
+    """Return (version, payload), or raise ValueError on bad encoding or checksum.
+    """
+    raw = b58decode(text)
+
+    if len(raw) < 5:
+        raise ValueError("Base58check data too short")
+
+    data, checksum = raw[:-4], raw[-4:]
+
+    if _checksum(data) != checksum:
+        raise ValueError("Base58check checksum mismatch")
+
+    return data[0], data[1:]
+
+
+def p2pkh_version(mainnet: bool) -> int:
+    return P2PKH_MAINNET if mainnet else P2PKH_TESTNET
+
+
+def address_to_hex(address: str, mainnet: bool) -> str:
+    """Equivalent of gethexaddress: the 20-byte hash of a P2PKH address, or ValueError.
+    """
+    version, payload = b58check_decode(address)
+
+    if version != p2pkh_version(mainnet) or len(payload) != 20:
+        raise ValueError(f"Not a {'mainnet' if mainnet else 'testnet'} P2PKH address: '{address}'")
+
+    return payload.hex()
+
+
+def hex_to_address(addr_hx: str, mainnet: bool) -> str:
+    """Equivalent of fromhexaddress: the P2PKH address for a 20-byte hex hash, or ValueError.
+    """
+    payload = bytes.fromhex(addr_hx)
+
+    if len(payload) != 20:
+        raise ValueError(f"Invalid hex address length: '{addr_hx}'")
+
+    return b58check_encode(p2pkh_version(mainnet), payload)
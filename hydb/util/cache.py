@@ -0,0 +1,64 @@
+"""Small thread-safe caches.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+__all__ = "LruTtlCache",
+
+
+class LruTtlCache:
+    """Mapping bounded to maxsize entries, evicting the least recently used, whose entries expire after ttl seconds.
+
+    A ttl can also be given per entry, e.g. to keep negative results for a shorter time.
+    """
+    MISSING = object()
+
+    maxsize: int
+    ttl: float
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__entries: OrderedDict = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Return the entry for key, or default (LruTtlCache.MISSING unless given) when absent or expired.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None:
+                return default
+
+            expires, value = entry
+
+            if expires <= time.monotonic():
+                del self.__entries[key]
+                return default
+
+            self.__entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self.__lock:
+            self.__entries[key] = expires, value
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
@@ -0,0 +1,32 @@
+"""Fast change detection for JSON values, for when only "did it change?" matters.
+
+DeepDiff builds a full report and is reserved for where an actual diff is needed.
+"""
+from typing import Any
+
+__all__ = "json_equal", "json_changed"
+
+
+def json_equal(a: Any, b: Any) -> bool:
+    """Structural equality that, unlike ==, tells 1, 1.0 and True apart. Stops at the first difference.
+    """
+    if isinstance(a, dict):
+        if not isinstance(b, dict) or len(a) != len(b):
+            return False
+
+        for key, value in a.items():
+            if key not in b or not json_equal(value, b[key]):
+                return False
+
+        return True
+
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(map(json_equal, a, b))
+
+    return type(a) is type(b) and a == b
+
+
+def json_changed(old: Any, new: Any) -> bool:
+    """True when old and new differ, as DeepDiff(old, new) would report.
+    """
+    return not json_equal(old, new)
@@ -0,0 +1,94 @@
+import json
+from datetime import datetime
+
+from sqlalchemy.orm.instrumentation import manager_of_class
+
+from hydb.api import schemas
+from hydb.db import Block, Addr, User, UserUniq, UserAddr, AddrHist, UserAddrHist
+from hydb.db.addr_hist import AddrHistBatch
+from hydb.event.client import Events
+
+ADDR_HX = "09188dbfe8e915e6a3c42842b079432007a3673f"
+ADDR_HY = "Ta8uUv4ha1krJeDB1kcLWGR42ShiA3Fpxy"
+NOW = datetime(2026, 1, 2, 3, 4, 5)
+
+
+def user_addr(addr: Addr) -> UserAddr:
+    uniq: UserUniq = manager_of_class(UserUniq).new_instance()  # UserUniq() creates node addresses.
+    uniq.pkid = 3
+    uniq.date_create = NOW
+    uniq.time_create = 1
+    uniq.name_weight = 1
+    uniq.name = "Some Body"
+    uniq.hyve_addr_hy = ADDR_HY
+
+    user = User(pkid=3, uniq=uniq, tg_user_id=4, info={}, data=None)
+
+    return UserAddr(
+        pkid=5, user_pk=3, addr_pk=addr.pkid, date_create=NOW, date_update=None, name="wallet",
+        block_t=None, block_c=0, token_l=[], info={}, data=None, user=user, addr=addr,
+    )
+
+
+def block_and_addr() -> tuple:
+    addr = Addr(pkid=2, addr_hx=ADDR_HX, addr_hy=ADDR_HY, addr_tp=Addr.Type.H, block_h=99, info={"balance": "5"})
+
+    tx = {"id": "t0", "outputs": [{"address": ADDR_HY, "value": "1"}]}
+    block = Block(
+        pkid=1, height=100, hash="b100", conf=1, info={"miner": ADDR_HY}, tx=[tx],
+        tx_addr=schemas.Block.tx_addr_index([tx]),
+    )
+
+    return block, addr
+
+
+def decoded(result: schemas.BlockSSEResult) -> schemas.BlockSSEResult:
+    data = result.model_dump_json()
+
+    assert json.loads(data)["block"]["tx_addr"] == {ADDR_HY: [0]}
+    return Events.block_event_decode(data)
+
+
+def test_create_event_from_batch():
+    block, addr = block_and_addr()
+    ua = user_addr(addr)
+
+    batch = AddrHistBatch(block)
+    batch.add_user(batch.add(addr, {"balance": "5"}, {"balance": "6"}), ua)
+    batch.hist_pkids, batch.user_pkids = [10], [20]  # As allocated by insert().
+
+    result = decoded(block.sse_result(30, schemas.SSEBlockEvent.create, batch.hist_results()))
+
+    assert result.id == 30
+    assert result.event == schemas.SSEBlockEvent.create
+    assert result.block.height == 100
+    assert [tx["id"] for tx in result.block.filter_tx(ADDR_HY)] == ["t0"]
+
+    hist, = result.hist
+    assert (hist.pkid, hist.block_pk, hist.addr_pk, hist.mined) == (10, 1, 2, True)
+    assert hist.info_new == {"balance": "6"}
+    assert hist.addr.addr_hy == ADDR_HY
+
+    hist_user, = hist.addr_hist_user
+    assert (hist_user.pkid, hist_user.addr_hist_pk, hist_user.user_addr_pk) == (20, 10, 5)
+    assert hist_user.user_addr.user.uniq.name == "Some Body"
+
+
+def test_mature_event_from_addr_hist():
+    block, addr = block_and_addr()
+    ua = user_addr(addr)
+
+    AddrHist(
+        pkid=10, block_pk=1, addr_pk=2, info_old={"balance": "5"}, info_new={"balance": "6"}, block=block, addr=addr,
+        addr_hist_user=[
+            UserAddrHist(pkid=20, user_addr_pk=5, addr_hist_pk=10, date_create=NOW, block_t=None, block_c=0, data=None, user_addr=ua),
+        ],
+    )
+
+    result = decoded(block.sse_result(31, schemas.SSEBlockEvent.mature, block.addr_hist))
+
+    assert result.event == schemas.SSEBlockEvent.mature
+
+    hist, = result.hist
+    assert (hist.pkid, hist.mined) == (10, True)
+    assert hist.addr_hist_user[0].date_create == NOW
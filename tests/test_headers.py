@@ -0,0 +1,114 @@
+from attrdict import AttrDict
+
+from hydb.db.block import Block
+from hydb.db.headers import HeaderChain
+
+
+class Node:
+    """Stand-in for the node RPC calls HeaderChain and Block.find_ancestor() make, over a list of hashes by height."""
+
+    def __init__(self, hashes: list, size: int = 10):
+        self.hashes = hashes
+        self.stale = {}  # Headers of blocks that left the chain, the node keeps them.
+        self.header_chain_size = size
+        self.rpc = self
+
+    def reorg(self, hashes: list) -> None:
+        self.stale.update((h, height) for height, h in enumerate(self.hashes) if h not in hashes)
+        self.hashes = hashes
+
+    def rpc_batch(self, method: str, params) -> list:
+        assert method == "getblockhash"
+        return [self.hashes[h] if h < len(self.hashes) else None for (h,) in params]
+
+    def getblockheader(self, blockhash: str) -> AttrDict:
+        if blockhash in self.stale:
+            height = self.stale[blockhash]
+            return AttrDict(height=height, confirmations=-1, previousblockhash=f"{blockhash[0]}{height - 1}")
+
+        height = self.hashes.index(blockhash)
+
+        return AttrDict(
+            height=height,
+            confirmations=len(self.hashes) - height,
+            previousblockhash=self.hashes[height - 1] if height else None,
+        )
+
+    @property
+    def tip(self) -> tuple:
+        return len(self.hashes) - 1, self.hashes[-1]
+
+
+def chain(n: int, branch: str = "a") -> list:
+    return [f"{branch}{h}" for h in range(n)]
+
+
+def loaded(node: Node) -> HeaderChain:
+    headers = HeaderChain()
+    headers.load(node, *node.tip)
+    return headers
+
+
+def test_advance_extends():
+    node = Node(chain(5))
+    headers = loaded(node)
+
+    node.hashes = chain(8)
+
+    assert headers.advance(node, *node.tip) is None
+    assert headers.height == 7
+    assert list(headers.hashes) == chain(8)
+
+
+def test_advance_reorg():
+    node = Node(chain(8))
+    headers = loaded(node)
+
+    node.reorg(chain(5) + chain(9, "b")[5:])
+
+    assert headers.advance(node, *node.tip) == 4
+    assert list(headers.hashes) == node.hashes
+
+
+def test_advance_tip_moves_back_onto_ancestor():
+    node = Node(chain(8))
+    headers = loaded(node)
+
+    node.hashes = chain(6)
+
+    assert headers.advance(node, *node.tip) == 5
+    assert headers.height == 5
+    assert list(headers.hashes) == chain(6)
+
+    node.hashes = chain(7)
+
+    assert headers.advance(node, *node.tip) is None
+    assert list(headers.hashes) == chain(7)
+
+
+def test_advance_window_slides():
+    node = Node(chain(12), size=4)
+    headers = loaded(node)
+
+    assert headers.base == 8
+
+    node.hashes = chain(14)
+
+    assert headers.advance(node, *node.tip) is None
+    assert headers.base == 10
+    assert headers.hash_at(9) is None
+    assert headers.on_main_chain(13, "a13") is True
+
+
+def test_reorg_while_offline():
+    node = Node(chain(8))
+    node.reorg(chain(5) + chain(10, "b")[5:])
+
+    headers = HeaderChain()
+    headers.load(node, 7, "a7")  # The local tip from before the reorg.
+
+    assert headers.advance(node, *node.tip) == HeaderChain.UNKNOWN
+    assert list(headers.hashes) == node.hashes
+
+    # Block.reorg() then finds the ancestor from the node's stale headers.
+    assert Block.find_ancestor(node, "a7") == (4, "a4")